@@ -4,33 +4,122 @@ CESAR CIPHER
 First historical cipher (substitution cipher) used by Julius Cesar.
 Obtained by shifting all letters of plaintext by 3 positions on the right.
 This algorithm let define the amplitude of the rotation.
+
+The brute force tries the 26 rotations, scores each candidate plaintext with the log-likelihood of its quadgrams (sequences of
+four letters) in English and keeps the best ones, so that many messages can be triaged without reading them.
+On long texts the letter frequencies alone find the rotation: decrypt_frequency() counts the letters once and translates once.
+http://practicalcryptography.com/cryptanalysis/text-characterisation/quadgrams/
 """
 
 
+import os
 import string
 from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
 
 
 TEXT = 'Type your text here...'
 ROT = 3
+TOP = 3                        # Candidates kept by decrypt_scored()
+MESSAGES_FILE = None           # Path to a file with one message per line, to brute force them all over a pool of processes
+WORKERS = None                 # Processes of the pool, None for one per CPU core
+FFT = False                    # Correlate the letter histogram with numpy.fft instead of a 26 x 26 product in decrypt_frequency()
 
-def encrypt(rot, text):
-    az_deque = deque([l for l in string.ascii_lowercase])                            # Create a deque of the lower ascii alphabet and rotate it
+# Training text for the quadgram statistics. Set QUADGRAMS_PATH to a file of "QUADGRAM count" lines (like english_quadgrams.txt
+# of practicalcryptography.com) for better scores on short messages.
+CORPUS = ('It was the best of times, it was the worst of times, it was the age of wisdom, it was the age of foolishness, '
+          'it was the epoch of belief, it was the epoch of incredulity, it was the season of light, it was the season of darkness, '
+          'it was the spring of hope, it was the winter of despair, we had everything before us, we had nothing before us. '
+          'The message will be sent to the commander of the northern army before the attack on the city begins at dawn. '
+          'All the officers should report to the headquarters and wait there for further instructions about the enemy positions. '
+          'When in the course of human events it becomes necessary for one people to dissolve the political bands which have '
+          'connected them with another, and to assume among the powers of the earth the separate and equal station to which '
+          'the laws of nature and of nature\'s God entitle them, a decent respect to the opinions of mankind requires that they '
+          'should declare the causes which impel them to the separation. We hold these truths to be self-evident, that all men '
+          'are created equal, that they are endowed by their creator with certain unalienable rights, that among these are life, '
+          'liberty and the pursuit of happiness. Call me Ishmael. Some years ago, never mind how long precisely, having little or '
+          'no money in my purse, and nothing particular to interest me on shore, I thought I would sail about a little and see '
+          'the watery part of the world. It is a way I have of driving off the spleen and regulating the circulation.')
+QUADGRAMS_PATH = None
+ENGLISH = np.array([8.167, 1.492, 2.782, 4.253, 12.702, 2.228, 2.015, 6.094, 6.966, 0.153, 0.772, 4.025, 2.406,
+                    6.749, 7.507, 1.929, 0.095, 5.987, 6.327, 9.056, 2.758, 0.978, 2.360, 0.150, 1.974, 0.074]) / 100    # Letter frequencies of English text
+
+TABLES = []                                                                          # Translation table of each rotation, built once below
+for rot in range(26):
+    az_deque = deque(string.ascii_lowercase)                                         # Create a deque of the lower ascii alphabet and rotate it
     az_deque.rotate(rot)
-    new_alphabet = ''.join(az_deque)
-                                                                  
-    rot_tab = text.maketrans(string.ascii_lowercase, new_alphabet)                   # Bulid a translation table
-    enc_text = text.translate(rot_tab)                                                 # Apply the alphabet translation
-    
     AZ_deque = deque(string.ascii_uppercase)                                         # Rotate separately the upper case ascii alphabet
     AZ_deque.rotate(rot)
-    new_alphabet = ''.join(AZ_deque)
-    
-    rot_tab = enc_text.maketrans(string.ascii_uppercase, new_alphabet)
-    return enc_text.translate(rot_tab)
+    TABLES.append(str.maketrans(string.ascii_letters, ''.join(az_deque) + ''.join(AZ_deque)))
+QUADGRAMS = {}                                                                       # Log-probabilities of the quadgrams, loaded on first use
+
+
+def encrypt(rot, text):
+    return text.translate(TABLES[rot % 26])                                          # Apply the alphabet translation
+
+
+def quadgram_table():                                                                # log10 probability of every quadgram, indexed by its 4 letters in base 26
+    if 'table' not in QUADGRAMS:
+        counts = np.zeros(26 ** 4)
+        if QUADGRAMS_PATH:
+            with open(QUADGRAMS_PATH, 'r') as file:
+                for line in file:
+                    quadgram, count = line.split()
+                    counts[int(np.ravel_multi_index([string.ascii_uppercase.index(l) for l in quadgram.upper()], (26,) * 4))] = float(count)
+        else:
+            counts += np.bincount(quadgram_codes(letter_codes(CORPUS)), minlength=26 ** 4)
+        letters = counts.reshape(26, -1).sum(axis=1) + 1                             # Letter counts from the first letter of each quadgram
+        unigrams = np.log10(letters / letters.sum())
+        backoff = np.add.outer(np.add.outer(unigrams, unigrams), np.add.outer(unigrams, unigrams)).ravel() + np.log10(0.1)
+        total = counts.sum()
+        QUADGRAMS['table'] = np.where(counts > 0, np.log10(np.maximum(counts, 1) / total), np.minimum(backoff, np.log10(1 / total)))    # Unseen quadgrams fall back on letter frequencies
+    return QUADGRAMS['table']
+
+
+def letter_codes(text):                                                              # Letters of text as integers 0-25, case and other characters dropped
+    folded = np.frombuffer(text.encode('utf-8'), dtype=np.uint8) | 0x20
+    return (folded[(folded >= ord('a')) & (folded <= ord('z'))] - ord('a')).astype(np.intp)
+
+
+def quadgram_codes(letters):
+    return ((letters[..., :-3] * 26 + letters[..., 1:-2]) * 26 + letters[..., 2:-1]) * 26 + letters[..., 3:]
+
+
+def score(text):                                                                     # Quadgram log-likelihood, higher for text that reads like English
+    return float(quadgram_table()[quadgram_codes(letter_codes(text))].sum())
+
+
+def decrypt_scored(enc_text, top=TOP):                                               # The top rotations by quadgram score, best first
+    letters = letter_codes(enc_text)
+    rotations = np.arange(26)
+    shifted = (letters[None, :] - rotations[:, None]) % 26                           # Letters after each rotation, the same shift as TABLES
+    scores = quadgram_table()[quadgram_codes(shifted)].sum(axis=1)
+    best = np.argsort(-scores, kind='stable')[:top]
+    return [{'Rotation': int(rot), 'Score': float(scores[rot]), 'Text': encrypt(int(rot), enc_text)} for rot in best]
+
+
+def decrypt_frequency(enc_text, fft=FFT):                                           # Single pass: the rotation whose plaintext letter histogram is the most likely in English
+    # The log-likelihood of rotation r is the circular correlation of the ciphertext histogram with the English log-frequencies,
+    # sum over c of counts[c] * log(ENGLISH[c - r]), computed for the 26 rotations at once. Only the best one is translated.
+    counts = np.bincount(letter_codes(enc_text), minlength=26)
+    weights = np.log10(ENGLISH)
+    if fft:
+        scores = np.fft.irfft(np.fft.rfft(counts) * np.conj(np.fft.rfft(weights)), n=26)
+    else:
+        scores = weights[(np.arange(26)[None, :] - np.arange(26)[:, None]) % 26] @ counts
+    rot = int(np.argmax(scores))
+    return {'Rotation': rot, 'Score': float(scores[rot]), 'Text': encrypt(rot, enc_text)}
+
+
+def decrypt_file(path, top=TOP, workers=WORKERS):                                   # Brute force every line of a file over a pool of processes, yielding (line number, candidates)
+    with open(path, 'r') as file:
+        messages = [line.rstrip('\n') for line in file]
+    quadgram_table()                                                                 # Load the statistics before the pool forks
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        yield from enumerate(executor.map(decrypt_scored, messages, [top] * len(messages), chunksize=max(1, len(messages) // (4 * (workers or os.cpu_count())))))    # About 4 chunks per worker, so small files still use them all
 
 
-    
 def decrypt_bruteforce(enc_text):
     for rot in range(26):
         text = encrypt(rot, enc_text)
@@ -38,6 +127,10 @@ def decrypt_bruteforce(enc_text):
             
             
 if __name__ == '__main__':
+    if MESSAGES_FILE:
+        for n, candidates in decrypt_file(MESSAGES_FILE):
+            print(n, '\t', candidates[0]['Rotation'], '\t', candidates[0]['Text'])
+        raise SystemExit
     # Encryption
     TEXT = TEXT.replace(' ', '')
     enc_text = encrypt(ROT, TEXT)
@@ -45,3 +138,5 @@ if __name__ == '__main__':
     
     # Decryption
     decrypt_bruteforce(enc_text)
+    print(f"\nBest rotation: {decrypt_scored(enc_text)[0]['Rotation']}")
+    print(f"Best rotation from the letter frequencies: {decrypt_frequency(enc_text)['Rotation']}")
@@ -11,44 +11,31 @@ import secrets
 from collections import deque
 from string import ascii_uppercase as AZ
 from string import punctuation
+import os
+import sys
 from copy import copy
+from time import perf_counter
+from contextlib import redirect_stdout
 
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))                                      # Enigma_Machine.py sits next to this script, also when it is loaded from another directory
+from Enigma_Machine import REFLECTOR, ROTOR_NAME, Machine, Plugboard, RotorSchedule, set_rotors, step_rotors, Cesar, batch_encrypt, stream_encrypt, key_sheets, write_key_sheets, read_key_sheets
 
-TEXT = 'Type your text here...'
 
+TEXT = 'Type your text here...'
 
-INNER_RING = {1:'EKMFLGDQVZNTOWYHXUSPAIBRCJ',
-              2:'AJDKSIRUXBLHWTMCQGZNPYFVOE',
-              3:'BDFHJLCPRTXVZNYEIWGAKMUSQO',
-              4:'ESOVPZJAYQUIRHXLNFTGKDCMWB',
-              5:'VZBRGITYUPSDNHLXAWMJQOFECK',
-              6:'JPGVOUMFYQBENHZRDKASXLICTW',
-              7:'NZJHGRCXMYSWBOUFAIVLPEKQDT',
-              8:'FKQHTLXOCBJSPDZRAMEWNIUYGV'}
-
-REFLECTOR = {'UKW_B':'YRUHQSLDPXNGOKMIEBFZCWVJAT',		
-             'UKW_C':'FVPJIAOYEDRZXWGCTKUQSBNMHL'}
-
-TURN_NOTCH = {1:'Q',           # If rotor steps from Q to R, the next rotor is advanced
-              2:'E',	       # If rotor steps from E to F, the next rotor is advanced
-              3:'V',	       # If rotor steps from V to W, the next rotor is advanced
-              4:'J',	       # If rotor steps from J to K, the next rotor is advanced
-              5:'Z',	       # If rotor steps from Z to A, the next rotor is advanced
-              6:['Z', 'M'],    # If rotor steps from Z to A, or from M to N the next rotor is advanced
-              7:['Z', 'M'],    # If rotor steps from Z to A, or from M to N the next rotor is advanced
-              8:['Z', 'M']}    # If rotor steps from Z to A, or from M to N the next rotor is advanced
-
-ROTOR_NAME = {1:'I',
-              2:'II', 
-              3:'III',
-              4:'IV',
-              5:'V',
-              6:'VI',
-              7:'VII',
-              8:'VIII'}
 
 MANUAL_SETUP = False
 DEBUG = False
+COMPILED_ENGINE = True         # Encrypt with the precomputed integer permutations instead of rotating deques
+BENCHMARK = False
+STREAM = False                 # Encrypt INPUT_FILE (stdin if None) to OUTPUT_FILE (stdout if None) chunk by chunk, instead of TEXT
+INPUT_FILE = None
+OUTPUT_FILE = None
+CHUNK_SIZE = 1 << 20           # Characters read at a time in streaming mode
+STREAM_PIECES = 1024           # Pieces of a chunk encrypted side by side by Enigma_batch()
+KEY_SHEETS = 0                 # Generate this many key sheets into KEY_SHEETS_PATH (CSV, or JSON if it ends with .json) instead of encrypting
+KEY_SHEETS_PATH = 'key_sheets.csv'
+SEED = None                    # Seed of the key sheets for reproducible tests, None for fresh random ones
 
 
 def setup():
@@ -100,79 +87,23 @@ def check_manual_setup(rotor, switches, start, ring_setting, reflector):
             return False
     if reflector not in REFLECTOR:
         return False
-    for i in switches:
-        other_switches= copy(switches)
-        other_switches.remove(i)
-        for j in other_switches:
-            if i != j and i != j[::-1]:
-                if i[0] in j or i[1] in j:
-                    return False
+    try:
+        Plugboard(switches)
+    except ValueError:
+        return False
     return True
   
 
-def set_rotors(start, rotor):
-    
-    ring_left = [deque(AZ), deque(INNER_RING[rotor[0]])]
-    offset = -1 * AZ.index(start[0])
-    ring_left[0].rotate(offset)
-    ring_left[1].rotate(offset)
-    
-    ring_centre = [deque(AZ), deque(INNER_RING[rotor[1]])]
-    offset = -1 * AZ.index(start[1])
-    ring_centre[0].rotate(offset)
-    ring_centre[1].rotate(offset)
-    
-    ring_right = [deque(AZ), deque(INNER_RING[rotor[2]])]
-    offset = -1 * AZ.index(start[2])
-    ring_right[0].rotate(offset)
-    ring_right[1].rotate(offset)
-    
-    return ring_left, ring_centre, ring_right
-    
-
-def step_rotors(ring_left, ring_centre, ring_right, rotor):
-    if ring_centre[0][0] in TURN_NOTCH[rotor[1]]:
-            ring_centre[0].rotate(-1)
-            ring_centre[1].rotate(-1)
-            ring_left[0].rotate(-1)
-            ring_left[1].rotate(-1)
-    if ring_right[0][0] in TURN_NOTCH[rotor[2]]:
-        ring_centre[0].rotate(-1)
-        ring_centre[1].rotate(-1)           
-    ring_right[0].rotate(-1)
-    ring_right[1].rotate(-1)
-    return ring_left, ring_centre, ring_right
-
-
-def plugboard(letter, switches):
-    for i, j in switches:
-        if letter == i:
-            return j
-        elif letter == j:
-            return i
-    return letter
-
-
-def Cesar(alphabets, letter, from_offset, to_offset):
-    from_alphabet = copy(alphabets[0])
-    from_alphabet.rotate(AZ.index(from_offset))
-
-    to_alphabet = copy(alphabets[1])
-    to_alphabet.rotate(AZ.index(to_offset))
-
-    rot_tab = letter.maketrans(''.join(from_alphabet), ''.join(to_alphabet))                   
-    return letter.translate(rot_tab)
-
-   
 def Enigma_process(text, rotors, ring_setting, start_positions, reflector_type, switches):
     ring_left, ring_centre, ring_right = set_rotors(start_positions, rotors)
+    plug = Plugboard(switches)
     alphabet = deque(AZ)
     
     enc_text = ''    
     for i in text:    
         ring_left, ring_centre, ring_right = step_rotors(ring_left, ring_centre, ring_right, rotors)
         
-        switched_letter_forward = plugboard(i, switches)
+        switched_letter_forward = plug.swap(i)
         
         rotor_right_forward = Cesar([alphabet, ring_right[1]], switched_letter_forward, 'A', ring_setting[2])
         rotor_centre_forward = Cesar([ring_right[0], ring_centre[1]], rotor_right_forward, ring_setting[2], ring_setting[1])
@@ -185,7 +116,7 @@ def Enigma_process(text, rotors, ring_setting, start_positions, reflector_type,
         rotor_centre_backward = Cesar([ring_centre[1], ring_right[0]], rotor_left_backward, ring_setting[1], ring_setting[2])
         rotor_right_backward = Cesar([ring_right[1], alphabet], rotor_centre_backward, ring_setting[2], 'A')
         
-        switched_letter_backward = plugboard(rotor_right_backward, switches)
+        switched_letter_backward = plug.swap(rotor_right_backward)
         enc_text += switched_letter_backward
 
         if DEBUG:
@@ -201,6 +132,50 @@ def Enigma_process(text, rotors, ring_setting, start_positions, reflector_type,
     return ' '.join([enc_text[i:i + 5] for i in range(0, len(enc_text), 5)])
         
 
+def Enigma_compiled(text, rotors, ring_setting, start_positions, reflector_type, switches):
+    enc_text = Machine(rotors, reflector_type, ring_setting, switches).encrypt(text, start_positions)
+    return ' '.join([enc_text[i:i + 5] for i in range(0, len(enc_text), 5)])
+
+
+def decrypt_from(index, fragment, rotors, ring_setting, start_positions, reflector_type, switches):    # Decrypt a fragment that starts at index of the message, without processing the letters before it
+    start_positions = RotorSchedule(rotors, start_positions).seek(index)
+    return Enigma_compiled(fragment, rotors, ring_setting, start_positions, reflector_type, switches)
+
+
+def Enigma_batch(texts, settings):                                                                 # Encrypt N messages, each one with its own (rotors, ring_setting, start_positions, reflector_type, switches)
+    return batch_encrypt(texts, settings, REFLECTOR)
+
+
+def encrypt_corpus(texts, seed=None, path=None):                                                  # Encrypt each message with its own generated key sheet, or with the key sheets of a file
+    settings = read_key_sheets(path) if path else key_sheets(len(texts), seed, tuple(REFLECTOR))
+    return settings, Enigma_batch(texts, settings[:len(texts)])
+
+
+def Enigma_stream(source, sink, rotors, ring_setting, start_positions, reflector_type, switches, chunk_size=CHUNK_SIZE, pieces=STREAM_PIECES):    # Encrypt a file or pipe in constant memory, writing the ciphertext as each chunk is done
+    return stream_encrypt(source, sink, (rotors, ring_setting, start_positions, reflector_type, switches), Enigma_batch, chunk_size, pieces)
+
+
+def benchmark(length=20000):                                                                       # Compare the throughput of the two engines on the same random setup
+    rotors, ring_setting, start_positions, reflector_type, switches = setup()
+    text = ''.join(secrets.choice(AZ) for i in range(length))
+    results = []
+    for engine in (Enigma_process, Enigma_compiled):
+        begin = perf_counter()
+        results.append(engine(text, rotors, ring_setting, start_positions, reflector_type, switches))
+        elapsed = perf_counter() - begin
+        print(f'{engine.__name__}: {length / elapsed:,.0f} letters/s')
+    assert(results[0] == results[1])
+
+    texts = [''.join(secrets.choice(AZ) for i in range(length // 100)) for n in range(100)]       # The same amount of letters, split into 100 messages with their own key sheets
+    settings = key_sheets(len(texts), reflectors=tuple(REFLECTOR))
+    begin = perf_counter()
+    batch = Enigma_batch(texts, settings)
+    elapsed = perf_counter() - begin
+    print(f'Enigma_batch: {length / elapsed:,.0f} letters/s')
+    assert(batch == [Enigma_compiled(text, *setting) for text, setting in zip(texts, settings)])
+    return results[1]
+
+
 def prep_text(text):                                                                                                                # Replace common puctuation with letters
     text = text.replace(' ', 'X')
     text = text.replace(',', 'QQ')
@@ -211,7 +186,21 @@ def prep_text(text):
 
 
 if __name__ == '__main__':
-    text = prep_text(TEXT)
-    rotors, ring_setting, start_positions, reflector_type, switches = setup()
-    enc_text = Enigma_process(text.upper(), rotors, ring_setting, start_positions, reflector_type, switches)
-    print(f'\nCiphertext: {enc_text}')
+    if BENCHMARK:
+        benchmark()
+    if KEY_SHEETS:
+        write_key_sheets(KEY_SHEETS_PATH, key_sheets(KEY_SHEETS, SEED, tuple(REFLECTOR)))
+        print(f'{KEY_SHEETS} key sheets written to {KEY_SHEETS_PATH}')
+    elif STREAM:
+        with redirect_stdout(sys.stderr):                                                                                           # The setup goes to stderr, so stdout carries only the ciphertext
+            setting = setup()
+        source = open(INPUT_FILE, 'r', errors='ignore') if INPUT_FILE else sys.stdin
+        sink = open(OUTPUT_FILE, 'w') if OUTPUT_FILE else sys.stdout
+        with source, sink:
+            Enigma_stream(source, sink, *setting)
+    else:
+        text = prep_text(TEXT)
+        rotors, ring_setting, start_positions, reflector_type, switches = setup()
+        engine = Enigma_compiled if COMPILED_ENGINE and not DEBUG else Enigma_process                                          # The debug trace is only printed by the deque engine
+        enc_text = engine(text.upper(), rotors, ring_setting, start_positions, reflector_type, switches)
+        print(f'\nCiphertext: {enc_text}')
@@ -0,0 +1,266 @@
+#/usr/bin/env python3
+"""
+CIPHERTEXT-ONLY ATTACK ON THE ENIGMA M3
+When no crib is available the Bombe cannot help. This attack, published by James Gillogly (Cryptologia, 1995) and improved
+by Geoff Sullivan and Frode Weierud, relies only on statistics of the decrypted text:
+
+1.) Decrypt the message with every rotor order, reflector and start position, with ring settings at A and no plugboard.
+    The right setup leaves some letters in clear, so its decryption has a higher index of coincidence (IoC) than the others.
+    A wrong right ring misplaces the turnovers of the centre rotor in most of the message, so that ring is scanned as well.
+2.) For the best setups, hill-climb the ring settings of the right and centre rotors, moving the start positions along
+    so that the rotor cores do not change. Only the turnovers move, so the IoC improves when they match the real ones.
+3.) Hill-climb the plugboard pairs, first with the IoC, then with bigram and trigram scores of the decrypted text.
+
+The attack needs a few hundred letters to work reliably: with the full 10 plugboard switches the IoC of stage 1 hardly
+separates the right setup from the others, so it works best on traffic with fewer switches or on longer messages.
+It gets faster the more cores the process pool has.
+https://web.archive.org/web/2006/http://www.fortunecity.com/skyscraper/coding/379/gillogly.htm
+https://www.tandfonline.com/doi/abs/10.1080/0161-110591893771
+"""
+
+import os
+import sys
+import secrets
+from string import ascii_uppercase as AZ
+from string import punctuation
+from itertools import permutations, product
+from time import perf_counter
+from types import ModuleType
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))                                      # Enigma_Machine.py sits next to this script, also when it is loaded from another directory
+from Enigma_Machine import INNER_RING, REFLECTOR, Plugboard, core_table, step_positions
+
+
+CIPHERTEXT = 'Type your ciphertext here...'
+
+
+# Training text for the bigram and trigram statistics, written the way Enigma operators prepared messages (X for spaces).
+# Set CORPUS_PATH to a larger text file in the same language as the traffic for better scores.
+CORPUS = ('AN DEN BEFEHLSHABER DER UNTERSEEBOOTE. WETTERVORHERSAGE FUER DAS SEEGEBIET BISKAYA UND DEN WESTLICHEN KANAL. '
+          'WIND AUS SUEDWEST STAERKE FUENF BIS SECHS, SPAETER ABNEHMEND. SICHT GUT, IM NORDEN REGEN UND NEBEL. '
+          'DAS BOOT MELDET KEINE BESONDEREN EREIGNISSE. FEINDLICHER GELEITZUG IN PLANQUADRAT ACHT SIEBEN GESICHTET, '
+          'KURS NORDOST, FAHRT ZEHN SEEMEILEN. ALLE BOOTE DER GRUPPE SOLLEN SOFORT ANGREIFEN UND STANDORT MELDEN. '
+          'DER KOMMANDANT BITTET UM NEUE BEFEHLE. TREIBSTOFF REICHT NOCH FUER DREI WOCHEN, TORPEDOS SIND VERSCHOSSEN. '
+          'OBERKOMMANDO DER WEHRMACHT GIBT BEKANNT: DIE VERSORGUNG DER TRUPPEN IST GESICHERT. DIE ANGRIFFE DES FEINDES '
+          'WURDEN UNTER SCHWEREN VERLUSTEN ABGEWIESEN. DIE EIGENEN VERBAENDE HALTEN DIE STELLUNGEN AM FLUSS. '
+          'FUNKSPRUCH AN ALLE STATIONEN: AB MORGEN NULL UHR GILT DER NEUE SCHLUESSEL. DIE ALTEN TAFELN SIND ZU VERNICHTEN. '
+          'BEI EINBRUCH DER DUNKELHEIT STOESST DIE DIVISION NACH OSTEN VOR UND SICHERT DIE BRUECKE UEBER DEN KANAL. '
+          'MUNITION UND VERPFLEGUNG WERDEN IN DER NACHT NACHGEFUEHRT. DER GEGNER VERSTAERKT SEINE ARTILLERIE IM SUEDEN. '
+          'ERBITTE LUFTAUFKLAERUNG UEBER DEM HAFEN. DAS WETTER BLEIBT UNBESTAENDIG MIT SCHAUERN UND AUFFRISCHENDEM WIND. '
+          'GENERALKOMMANDO MELDET: DIE LAGE IST UNVERAENDERT, KEINE VERLUSTE, DIE BEREITSCHAFT BLEIBT BESTEHEN.')
+CORPUS_PATH = None
+
+ROTOR_ORDERS = None            # Rotor orders to scan, None for all the orders of the rotors in INNER_RING
+KEEP = 5                       # Best start positions kept for each rotor order and reflector
+RING_PHASES = True             # Scan the right ring too: it sets when the centre rotor turns over, stage 1 gets 26 times slower
+CANDIDATES = 20                # Best setups kept for the ring and plugboard hill climbing
+MAX_SWITCHES = 10
+WORKERS = None                 # Processes of the pool, None for one per CPU core
+BENCHMARK = False
+
+
+def prep_text(text):
+    text = text.upper().replace('Ä', 'AE').replace('Ö', 'OE').replace('Ü', 'UE').replace('ß', 'SS')
+    text = text.replace(' ', 'X')
+    text = text.replace(',', 'QQ')
+    for p in punctuation:
+        text = text.replace(p, '')
+    return ''.join(l for l in text if l in AZ)
+
+
+def to_ints(text):
+    return np.frombuffer(text.encode('ascii'), dtype=np.uint8) - ord('A')
+
+
+def letter_paths(rotors, reflector_type, ring_setting, start, length, core=None):                 # Scrambler of every key press of one setup, as a (length, 26) table
+    core = core_table(rotors, reflector_type) if core is None else core
+    l, c, r = step_positions(rotors, np.array([start]), length)[:, 0]
+    rings = np.array(ring_setting)
+    return core[(l - rings[0]) % 26, (c - rings[1]) % 26, (r - rings[2]) % 26]
+
+
+def apply(cipher, path, plug):                                                                     # Plugboard -> scrambler -> plugboard, for all the letters at once
+    return plug[path[np.arange(len(cipher)), plug[cipher]]]
+
+
+def encrypt(text, rotors, ring_setting, start_positions, reflector_type, switches):                 # Same output as Enigma_process() in Enigma M3.py, without the 5-letter groups
+    cipher = to_ints(text)
+    start = [AZ.index(l) for l in start_positions]
+    ring_setting = [AZ.index(l) for l in ring_setting]
+    path = letter_paths(rotors, reflector_type, ring_setting, start, len(cipher))
+    return ''.join(AZ[i] for i in apply(cipher, path, np.array(Plugboard(switches).table)))
+
+
+# functions of scoring
+def ioc(letters):
+    counts = np.bincount(letters, minlength=26)
+    return (counts * (counts - 1)).sum() / max(len(letters) * (len(letters) - 1), 1)
+
+
+def ngram_tables(text):                                                                            # Log-probabilities of bigrams and trigrams, with add-one smoothing
+    letters = to_ints(prep_text(text)).astype(np.intp)
+    bigrams = np.bincount(letters[:-1] * 26 + letters[1:], minlength=26 ** 2) + 1.0
+    trigrams = np.bincount((letters[:-2] * 26 + letters[1:-1]) * 26 + letters[2:], minlength=26 ** 3) + 1.0
+    return np.log(bigrams / bigrams.sum()), np.log(trigrams / trigrams.sum())
+
+
+def load_ngrams():
+    if 'tables' not in NGRAMS:
+        text = CORPUS
+        if CORPUS_PATH:
+            with open(CORPUS_PATH, 'r') as file:
+                text = file.read()
+        NGRAMS['tables'] = ngram_tables(text)
+    return NGRAMS['tables']
+
+
+NGRAMS = {}
+
+
+def bigram_score(letters):
+    letters = letters.astype(np.intp)
+    return load_ngrams()[0][letters[:-1] * 26 + letters[1:]].sum()
+
+
+def trigram_score(letters):
+    letters = letters.astype(np.intp)
+    return load_ngrams()[1][(letters[:-2] * 26 + letters[1:-1]) * 26 + letters[2:]].sum()
+
+
+# stage 1: rotor orders and start positions
+def rank_starts(cipher, rotors, reflector_type, keep=KEEP, ring_phases=RING_PHASES):           # Best start positions of one rotor order and reflector, by IoC without plugboard
+    core = core_table(rotors, reflector_type)
+    scores = []
+    for left, ring_right in product(range(26), range(26) if ring_phases else [0]):               # One block of 676 start positions at a time, to bound the memory
+        starts = np.array([(left, c, (r + ring_right) % 26) for c in range(26) for r in range(26)])
+        l, c, r = step_positions(rotors, starts, len(cipher))
+        letters = core[l, c, (r - ring_right) % 26, cipher[None, :]].astype(np.intp)
+        counts = np.bincount((np.arange(len(starts))[:, None] * 26 + letters).ravel(), minlength=len(starts) * 26).reshape(len(starts), 26)
+        block = (counts * (counts - 1)).sum(axis=1) / (len(cipher) * (len(cipher) - 1))
+        for n in np.argsort(block)[-keep:]:
+            scores.append((block[n], tuple(int(i) for i in starts[n]), ring_right))
+    scores.sort(reverse=True)
+    return [{'Rotors': rotors, 'Reflector': reflector_type, 'Start': start, 'Ring setting': (0, 0, ring_right), 'IoC': score} for score, start, ring_right in scores[:keep]]
+
+
+# stage 2: ring settings
+def climb_rings(cipher, setup):                                                                    # Move ring and start together, so that only the turnovers of the right and centre rotors change
+    core = core_table(setup['Rotors'], setup['Reflector'])
+    identity = np.arange(26)
+    best = dict(setup)
+    for rotor in (2, 1):
+        for ring in range(26):
+            ring_setting = list(best['Ring setting'])
+            start = list(best['Start'])
+            start[rotor] = (start[rotor] - ring_setting[rotor] + ring) % 26
+            ring_setting[rotor] = ring
+            path = letter_paths(setup['Rotors'], setup['Reflector'], ring_setting, start, len(cipher), core)
+            score = ioc(apply(cipher, path, identity))
+            if score > best['IoC']:
+                best.update({'Start': tuple(start), 'Ring setting': tuple(ring_setting), 'IoC': score})
+    return best
+
+
+# stage 3: plugboard
+def climb_plugboard(cipher, path, score_function, plug=None, max_switches=MAX_SWITCHES):         # Try every pair of letters as a new switch, keep it if the score improves, until no pair helps
+    plug = np.arange(26) if plug is None else plug.copy()
+    best = score_function(apply(cipher, path, plug))
+    improved = True
+    while improved:
+        improved = False
+        for i, j in ((i, j) for i in range(26) for j in range(i + 1, 26)):
+            trial = plug.copy()
+            if trial[i] == j:                                                                      # Remove a switch already in place
+                trial[i], trial[j] = i, j
+            else:
+                for k in (i, j):                                                                   # Free both letters from their current switches
+                    trial[trial[k]] = trial[k]
+                    trial[k] = k
+                trial[i], trial[j] = j, i
+            if (trial != np.arange(26)).sum() > 2 * max_switches:
+                continue
+            score = score_function(apply(cipher, path, trial))
+            if score > best:
+                best, plug, improved = score, trial, True
+    return plug, best
+
+
+def solve_setup(cipher, setup):                                                                     # Stages 2 and 3 for one setup of stage 1
+    setup = climb_rings(cipher, setup)
+    path = letter_paths(setup['Rotors'], setup['Reflector'], setup['Ring setting'], setup['Start'], len(cipher))
+    plug, _ = climb_plugboard(cipher, path, ioc)
+    plug, _ = climb_plugboard(cipher, path, bigram_score, plug)
+    plug, score = climb_plugboard(cipher, path, trigram_score, plug)
+    text = ''.join(AZ[i] for i in apply(cipher, path, plug))
+    switches = [(AZ[i], AZ[j]) for i, j in enumerate(plug) if i < j]
+    return {'Rotors': setup['Rotors'], 'Reflector': setup['Reflector'], 'Start': tuple(AZ[i] for i in setup['Start']),
+            'Ring setting': tuple(AZ[i] for i in setup['Ring setting']), 'Plugboard': switches, 'Score': score, 'Text': text}
+
+
+def register_module():
+    # The workers receive the stage functions pickled by reference to this module. When it is loaded with importlib under
+    # another name without adding it to sys.modules, register it here before the pool forks.
+    # With the spawn start method (Windows, macOS) the workers import the module again, so it must be importable by that name.
+    if __name__ not in sys.modules:
+        module = ModuleType(__name__)
+        module.__dict__.update(globals())
+        sys.modules[__name__] = module
+
+
+def solve(enc_text, rotor_orders=ROTOR_ORDERS, reflectors=None, keep=KEEP, candidates=CANDIDATES, workers=WORKERS, verbose=True):
+    cipher = to_ints(enc_text.replace(' ', '').upper())
+    shards = list(product(rotor_orders or permutations(INNER_RING, 3), reflectors or REFLECTOR))
+    begin = perf_counter()
+    register_module()
+    executor = ProcessPoolExecutor(max_workers=workers)
+    try:
+        setups = []
+        futures = [executor.submit(rank_starts, cipher, rotors, reflector, keep) for rotors, reflector in shards]
+        for n, future in enumerate(as_completed(futures)):
+            setups.extend(future.result())
+            if verbose:
+                print(f'\r[+] Rotor setups {n + 1}/{len(shards)}, {perf_counter() - begin:.1f}s', end='\r', flush=True)
+        setups.sort(key=lambda x : x['IoC'], reverse=True)
+        if verbose:
+            print(f'\n[+] Hill climbing {min(candidates, len(setups))} setups')
+        futures = [executor.submit(solve_setup, cipher, setup) for setup in setups[:candidates]]
+        results = [future.result() for future in as_completed(futures)]
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+    results.sort(key=lambda x : x['Score'], reverse=True)
+    elapsed = perf_counter() - begin
+    for result in results:
+        result['Time'] = elapsed
+    if verbose:
+        print(f'[+] Time to solution: {elapsed:.1f}s')
+    return results
+
+
+def random_setup(switches):
+    rotors = tuple(secrets.SystemRandom().sample(sorted(INNER_RING), 3))
+    letters = secrets.SystemRandom().sample(AZ, 2 * switches)
+    return rotors, tuple(secrets.choice(AZ) for i in range(3)), tuple(secrets.choice(AZ) for i in range(3)), secrets.choice(list(REFLECTOR)), list(zip(letters[::2], letters[1::2]))
+
+
+def benchmark(lengths=(100, 200, 300, 400, 500), switches=5, rotor_orders=ROTOR_ORDERS, workers=WORKERS):    # Time to solution and recovered letters on synthetic messages
+    corpus = prep_text(CORPUS)
+    for length in lengths:
+        begin = secrets.randbelow(len(corpus) - length)
+        text = corpus[begin:begin + length]
+        rotors, ring_setting, start, reflector, plugboard = random_setup(switches)
+        enc_text = encrypt(text, rotors, ring_setting, start, reflector, plugboard)
+        orders = rotor_orders if rotor_orders is None else list(set(rotor_orders) | {rotors})      # A restricted benchmark still contains the right rotor order
+        result = solve(enc_text, orders, workers=workers, verbose=False)[0]
+        recovered = sum(a == b for a, b in zip(result['Text'], text)) / length
+        print(f'{length} letters: {result["Time"]:.1f}s, {recovered:.0%} of the plaintext recovered, rotors {result["Rotors"]} (real {rotors})')
+
+
+if __name__ == '__main__':
+    if BENCHMARK:
+        benchmark()
+    else:
+        best = solve(CIPHERTEXT)[0]
+        for key, value in best.items():
+            print(f'{key}: {value}')
@@ -0,0 +1,474 @@
+#/usr/bin/env python3
+"""
+ENIGMA MACHINE MODEL
+Wirings, rotors, stepping, plugboard and the batch and stream engines shared by Enigma M3.py, Enigma M4.py, Turing Bombe.py and Enigma_Ciphertext_Only.py.
+Every rotor is compiled once into integer permutations for each of its 26 offsets (position - ring setting), so the tools
+encrypt with table lookups and any speed-up of this model applies to all of them.
+The M4 is the same machine with a thin wheel and a thin reflector: the thin wheel never moves during a message, so the
+model folds the two into one composite reflector and keeps three stepping rotors.
+Rotors VI, VII and VIII have two notches: the stepping and RotorSchedule take any number of notches per rotor.
+"""
+
+from collections import deque
+from string import ascii_uppercase as AZ
+from copy import copy
+import csv
+import re
+import json
+import numpy as np
+
+
+INNER_RING = {1:'EKMFLGDQVZNTOWYHXUSPAIBRCJ',
+              2:'AJDKSIRUXBLHWTMCQGZNPYFVOE',
+              3:'BDFHJLCPRTXVZNYEIWGAKMUSQO',
+              4:'ESOVPZJAYQUIRHXLNFTGKDCMWB',
+              5:'VZBRGITYUPSDNHLXAWMJQOFECK',
+              6:'JPGVOUMFYQBENHZRDKASXLICTW',
+              7:'NZJHGRCXMYSWBOUFAIVLPEKQDT',
+              8:'FKQHTLXOCBJSPDZRAMEWNIUYGV'}
+
+REFLECTOR = {'UKW_B':'YRUHQSLDPXNGOKMIEBFZCWVJAT',
+             'UKW_C':'FVPJIAOYEDRZXWGCTKUQSBNMHL'}
+
+THIN_REFLECTOR = {'B_Thin':'ENKQAUYWJICOPBLMDXZVFTHRGS',
+                  'C_Thin':'RDOBJNTKVEHMLFCWZAXGYIPSUQ'}
+
+ADDITIONAL_WHEEL = {'Beta':'LEYJVCNIXWPBQMDRTAKZGFUHOS',
+                    'Gamma':'FSOKANUERHMBTIYCWLQPZXVGJD'}
+
+TURN_NOTCH = {1:'Q',           # If rotor steps from Q to R, the next rotor is advanced
+              2:'E',           # If rotor steps from E to F, the next rotor is advanced
+              3:'V',           # If rotor steps from V to W, the next rotor is advanced
+              4:'J',           # If rotor steps from J to K, the next rotor is advanced
+              5:'Z',           # If rotor steps from Z to A, the next rotor is advanced
+              6:['Z', 'M'],    # If rotor steps from Z to A, or from M to N the next rotor is advanced
+              7:['Z', 'M'],    # If rotor steps from Z to A, or from M to N the next rotor is advanced
+              8:['Z', 'M']}    # If rotor steps from Z to A, or from M to N the next rotor is advanced
+
+ROTOR_NAME = {1:'I',
+              2:'II',
+              3:'III',
+              4:'IV',
+              5:'V',
+              6:'VI',
+              7:'VII',
+              8:'VIII'}
+
+
+def compile_rotor(wiring):                                                                         # Forward and inverse permutations for each of the 26 offsets (position - ring setting)
+    forward = [AZ.index(l) for l in wiring]
+    backward = [forward.index(i) for i in range(26)]
+    forward_tables = [[(forward[(x + s) % 26] - s) % 26 for x in range(26)] for s in range(26)]
+    backward_tables = [[(backward[(x + s) % 26] - s) % 26 for x in range(26)] for s in range(26)]
+    return forward_tables, backward_tables
+
+
+def compile_plugboard(switches):                                                                   # Plugboard as an integer involution
+    return Plugboard(switches).table
+
+
+class Rotor:                                                                                       # Wiring compiled for every offset, and the notch positions that turn the next rotor
+    __slots__ = ('name', 'forward', 'backward', 'notches')
+
+    def __init__(self, name, wiring, notches=()):
+        self.name = name
+        self.forward, self.backward = compile_rotor(wiring)
+        self.notches = frozenset(AZ.index(l) for l in notches)
+
+
+class Reflector:
+    __slots__ = ('name', 'table')
+
+    def __init__(self, name, wiring):
+        self.name = name
+        self.table = [AZ.index(l) for l in wiring]
+
+    def composite(self, thin_wheel, offset):                                                       # Thin wheel -> thin reflector -> thin wheel, as one reflector for a fixed thin wheel offset
+        forward, backward = thin_wheel.forward[offset], thin_wheel.backward[offset]
+        return [backward[self.table[forward[x]]] for x in range(26)]
+
+
+ROTORS = {r: Rotor(ROTOR_NAME[r], INNER_RING[r], TURN_NOTCH[r]) for r in INNER_RING}
+THIN_WHEELS = {w: Rotor(w, ADDITIONAL_WHEEL[w]) for w in ADDITIONAL_WHEEL}
+REFLECTORS = {r: Reflector(r, wiring) for r, wiring in {**REFLECTOR, **THIN_REFLECTOR}.items()}
+COMPOSITE_REFLECTOR = {f'{r} {w} {AZ[offset]}': ''.join(AZ[x] for x in REFLECTORS[r].composite(THIN_WHEELS[w], offset))    # Thin reflector, thin wheel and its offset (position
+                       for r in THIN_REFLECTOR for w in ADDITIONAL_WHEEL for offset in range(26)}                        # at ring A) as one reflector: 2 x 2 x 26 wirings
+REFLECTORS.update({r: Reflector(r, wiring) for r, wiring in COMPOSITE_REFLECTOR.items()})
+
+
+class Machine:                                                                                     # Three stepping rotors, a reflector and a plugboard, plus the thin wheel of the M4 when given
+    __slots__ = ('rotor_numbers', 'rotors', 'reflector', 'thin_wheel', 'rings', 'plugboard')
+
+    def __init__(self, rotors, reflector_type, ring_setting, switches=(), thin_wheel_type=None):
+        self.rotor_numbers = tuple(rotors)
+        self.rotors = tuple(ROTORS[r] for r in rotors)
+        self.reflector = REFLECTORS[reflector_type]
+        self.thin_wheel = THIN_WHEELS[thin_wheel_type] if thin_wheel_type else None
+        self.rings = tuple(AZ.index(l) for l in ring_setting)                                      # Thin wheel ring first for the M4, like its start positions
+        self.plugboard = switches if isinstance(switches, Plugboard) else Plugboard(switches)
+
+    def reflector_table(self, positions):                                                         # Reflector seen by the left rotor, the thin wheel included
+        if self.thin_wheel is None:
+            return self.reflector.table
+        return self.reflector.composite(self.thin_wheel, (AZ.index(positions[0]) - self.rings[0]) % 26)
+
+    def scrambler(self, positions):                                                               # Permutation of the rotors and reflector (no plugboard) at the given positions
+        reflector = self.reflector_table(positions)
+        (left, centre, right), (left_ring, centre_ring, right_ring) = self.rotors, self.rings[-3:]
+        l, c, r = (AZ.index(p) for p in positions[-3:])
+        l, c, r = (l - left_ring) % 26, (c - centre_ring) % 26, (r - right_ring) % 26
+        left_forward, centre_forward, right_forward = left.forward[l], centre.forward[c], right.forward[r]
+        left_backward, centre_backward, right_backward = left.backward[l], centre.backward[c], right.backward[r]
+        return [right_backward[centre_backward[left_backward[reflector[left_forward[centre_forward[right_forward[x]]]]]]] for x in range(26)]
+
+    def schedule(self, start_positions):
+        return RotorSchedule(self.rotor_numbers, start_positions)
+
+    def encrypt(self, text, start_positions):                                                     # Letters of text encrypted from the start positions, other characters pass unchanged but still step the rotors
+        (left_rotor, centre_rotor, right_rotor), (left_ring, centre_ring, right_ring) = self.rotors, self.rings[-3:]
+        reflector = self.reflector_table(start_positions)
+        plug = self.plugboard.table
+        left_forward, centre_forward, right_forward = left_rotor.forward, centre_rotor.forward, right_rotor.forward
+        left_backward, centre_backward, right_backward = left_rotor.backward, centre_rotor.backward, right_rotor.backward
+        centre_notch, right_notch = centre_rotor.notches, right_rotor.notches
+        left, centre, right = (AZ.index(l) for l in start_positions[-3:])
+        letter_index = {l: i for i, l in enumerate(AZ)}
+
+        enc_text = []
+        for letter in text:
+            if centre in centre_notch:                                                             # Same stepping as step_rotors(), double step included
+                centre = (centre + 1) % 26
+                left = (left + 1) % 26
+            if right in right_notch:
+                centre = (centre + 1) % 26
+            right = (right + 1) % 26
+
+            if letter not in letter_index:
+                enc_text.append(letter)
+                continue
+            l = (left - left_ring) % 26
+            c = (centre - centre_ring) % 26
+            r = (right - right_ring) % 26
+            x = plug[letter_index[letter]]
+            x = left_forward[l][centre_forward[c][right_forward[r][x]]]
+            x = right_backward[r][centre_backward[c][left_backward[l][reflector[x]]]]
+            enc_text.append(AZ[plug[x]])
+        return ''.join(enc_text)
+
+
+# functions of the deque machine, step by step like the real rotors (used by the debug traces)
+def set_rotor(position, wiring):
+    ring = [deque(AZ), deque(wiring)]
+    offset = -1 * AZ.index(position)
+    ring[0].rotate(offset)
+    ring[1].rotate(offset)
+    return ring
+
+
+def set_rotors(start, rotor, wheel_type=None):                                                     # Left, centre and right rotors, then the thin wheel of the M4 (first of the start positions)
+    rings = [set_rotor(position, INNER_RING[r]) for position, r in zip(start[-3:], rotor)]
+    if wheel_type is not None:
+        rings.append(set_rotor(start[0], ADDITIONAL_WHEEL[wheel_type]))
+    return tuple(rings)
+
+
+def step_rotors(ring_left, ring_centre, ring_right, rotor):
+    if ring_centre[0][0] in TURN_NOTCH[rotor[1]]:
+        ring_centre[0].rotate(-1)
+        ring_centre[1].rotate(-1)
+        ring_left[0].rotate(-1)
+        ring_left[1].rotate(-1)
+    if ring_right[0][0] in TURN_NOTCH[rotor[2]]:
+        ring_centre[0].rotate(-1)
+        ring_centre[1].rotate(-1)
+    ring_right[0].rotate(-1)
+    ring_right[1].rotate(-1)
+    return ring_left, ring_centre, ring_right
+
+
+def Cesar(alphabets, letter, from_offset, to_offset):
+    from_alphabet = copy(alphabets[0])
+    from_alphabet.rotate(AZ.index(from_offset))
+
+    to_alphabet = copy(alphabets[1])
+    to_alphabet.rotate(AZ.index(to_offset))
+
+    rot_tab = letter.maketrans(''.join(from_alphabet), ''.join(to_alphabet))
+    return letter.translate(rot_tab)
+
+
+class RotorSchedule:                                                                               # Rotor positions at any index of a message, computed directly instead of replaying step_rotors()
+    def __init__(self, rotors, start_positions):
+        self.start_positions = tuple(start_positions)
+        self.left, self.centre, self.right = (AZ.index(l) for l in self.start_positions[-3:])
+        self.centre_notch = sorted(AZ.index(l) for l in TURN_NOTCH[rotors[-2]])
+        self.right_notch = sorted((AZ.index(l) - self.right) % 26 for l in TURN_NOTCH[rotors[-1]])    # Key presses (minus one) at which the right rotor first turns the centre one
+
+    def __getitem__(self, index):                                                                  # Positions used to encrypt the letter at index (after index + 1 key presses)
+        if isinstance(index, slice):
+            if index.stop is None:
+                raise ValueError('The schedule is endless, a slice needs a stop index')
+            if (index.start or 0) < 0 or index.stop < 0:
+                raise IndexError('The schedule has no negative indexes')
+            return [self[i] for i in range(index.start or 0, index.stop, index.step or 1)]
+        if index < 0:
+            raise IndexError('The schedule has no negative indexes')
+        return self.positions(index + 1)
+
+    def seek(self, index):                                                                         # Start positions to resume the machine right before the letter at index
+        return self.positions(index)
+
+    def turnovers(self, presses):                                                                  # Number of times the right rotor turned the centre one, and key press of the last time
+        count = 0
+        last = 0
+        for d in self.right_notch:
+            if presses > d:
+                count += (presses - d - 1) // 26 + 1
+        if count:
+            q, i = divmod(count - 1, len(self.right_notch))
+            last = 26 * q + self.right_notch[i] + 1
+        return count, last
+
+    def notch_visits(self, steps):                                                                 # Number of notch positions among the first steps positions of the centre rotor
+        count = 0
+        for n in self.centre_notch:
+            d = (n - self.centre) % 26
+            if steps > d:
+                count += (steps - d - 1) // 26 + 1
+        return count
+
+    def positions(self, presses):
+        if presses == 0:
+            return self.start_positions
+        turnovers, last = self.turnovers(presses)
+        steps = turnovers                                                                          # Every notch visited by the centre rotor adds a double step, so iterate to the fixed point
+        while steps != turnovers + self.notch_visits(steps):
+            steps = turnovers + self.notch_visits(steps)
+        while (self.centre + steps) % 26 in self.centre_notch and last < presses:                  # The double step of the last notch reached happens at the next key press
+            steps += 1
+            last += 1
+        double_steps = steps - turnovers
+        positions = (AZ[(self.left + double_steps) % 26], AZ[(self.centre + steps) % 26], AZ[(self.right + presses) % 26])
+        return self.start_positions[:-3] + positions
+
+
+SELF_PAIRS = sum(1 << 27 * i for i in range(26))                                                  # Bits of the pairs that plug a letter to itself (a Bombe hypothesis, not a cable)
+
+
+class Plugboard:                                                                                   # 26-entry involution, plus bitsets of the plugged letters and of the pairs
+    __slots__ = ('table', 'mask', 'pairs')
+
+    def __init__(self, switches=()):
+        self.table = list(range(26))
+        self.mask = 0
+        self.pairs = 0
+        for i, j in switches:
+            if not self.connect(AZ.index(i), AZ.index(j)):
+                raise ValueError(f'Switch {i}{j} uses a letter already plugged')
+
+    def connect(self, a, b):                                                                       # Add the pair a-b, False if one of its letters is already plugged elsewhere
+        pair = 1 << 26 * min(a, b) + max(a, b)
+        if self.pairs & pair:
+            return True
+        if self.mask & (1 << a | 1 << b):
+            return False
+        self.table[a], self.table[b] = b, a
+        self.mask |= 1 << a | 1 << b
+        self.pairs |= pair
+        return True
+
+    def swap(self, letter):                                                                        # Plugged partner of a letter, other characters pass unchanged
+        if letter in AZ and len(letter) == 1:
+            return AZ[self.table[ord(letter) - 65]]
+        return letter
+
+    def compatible(self, other):                                                                   # No letter plugged to two different partners: each letter in use is covered by exactly one pair
+        pairs = self.pairs | other.pairs
+        return 2 * pairs.bit_count() - (pairs & SELF_PAIRS).bit_count() == (self.mask | other.mask).bit_count()
+
+    def merge(self, other):                                                                        # Union of two compatible plugboards, None if they clash
+        if not self.compatible(other):
+            return None
+        merged = Plugboard()
+        merged.table = [t if self.mask >> i & 1 else other.table[i] for i, t in enumerate(self.table)]
+        merged.mask = self.mask | other.mask
+        merged.pairs = self.pairs | other.pairs
+        return merged
+
+    def __iter__(self):                                                                            # Switches as 'AB' strings, letters plugged to themselves included
+        return (AZ[i] + AZ[j] for i, j in enumerate(self.table) if self.mask >> i & 1 and i <= j)
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def __eq__(self, other):
+        return isinstance(other, Plugboard) and self.pairs == other.pairs
+
+    def __hash__(self):
+        return hash(self.pairs)
+
+    def __repr__(self):
+        return f"Plugboard({' '.join(self)})"
+
+
+# functions of the key sheets
+KEY_SHEET_FIELDS = ('Rotors', 'Ring settings', 'Start positions', 'Reflector', 'Plugboard switches', 'Thin wheel')
+
+
+def key_sheets(count, seed=None, reflectors=tuple(REFLECTOR), thin_wheels=None, switches=10):  # count random settings at once, like setup() of Enigma M3.py (Enigma M4.py with thin_wheels)
+    # The same seed gives the same key sheets, for reproducible tests. The NumPy generator is not a cryptographic one,
+    # so key sheets for real traffic should leave the seed to None: it is then drawn from the operating system.
+    rng = np.random.default_rng(seed)
+    wheels = 4 if thin_wheels else 3
+    rotors = rng.permuted(np.tile(np.arange(1, len(INNER_RING) + 1), (count, 1)), axis=1)[:, :3]   # Three unique rotors per sheet
+    rings = rng.integers(26, size=(count, wheels))
+    starts = rng.integers(26, size=(count, wheels))
+    reflector_types = rng.integers(len(reflectors), size=count)
+    letters = rng.permuted(np.tile(np.arange(26), (count, 1)), axis=1)[:, :2 * switches]           # Disjoint pairs: 2 x switches distinct letters per sheet
+    thin_wheel_types = rng.integers(len(thin_wheels), size=count) if thin_wheels else None
+    settings = []
+    for n in range(count):
+        setting = (tuple(int(r) for r in rotors[n]), tuple(AZ[i] for i in rings[n]), tuple(AZ[i] for i in starts[n]), reflectors[reflector_types[n]],
+                   [(AZ[a], AZ[b]) for a, b in zip(letters[n, ::2], letters[n, 1::2])])
+        settings.append(setting + (thin_wheels[thin_wheel_types[n]],) if thin_wheels else setting)
+    return settings
+
+
+def key_sheet_rows(settings):                                                                       # Settings as rows of text, with the rotor names of the printed key sheets
+    for setting in settings:
+        rotors, ring_setting, start, reflector, switches = setting[:5]
+        yield {'Rotors': ' '.join(ROTOR_NAME[r] for r in rotors), 'Ring settings': ''.join(ring_setting), 'Start positions': ''.join(start),
+               'Reflector': reflector, 'Plugboard switches': ' '.join(a + b for a, b in switches), 'Thin wheel': setting[5] if len(setting) > 5 else ''}
+
+
+def write_key_sheets(path, settings):                                                               # JSON if path ends with .json, CSV otherwise
+    rows = list(key_sheet_rows(settings))
+    with open(path, 'w', newline='') as file:
+        if path.lower().endswith('.json'):
+            json.dump(rows, file, indent=1)
+        else:
+            writer = csv.DictWriter(file, KEY_SHEET_FIELDS)
+            writer.writeheader()
+            writer.writerows(rows)
+
+
+def read_key_sheets(path):                                                                          # Settings written by write_key_sheets(), ready for Enigma_batch()
+    rotor_numbers = {name: r for r, name in ROTOR_NAME.items()}
+    with open(path, 'r', newline='') as file:
+        rows = json.load(file) if path.lower().endswith('.json') else list(csv.DictReader(file))
+    settings = []
+    for row in rows:
+        setting = (tuple(rotor_numbers[r] for r in row['Rotors'].split()), tuple(row['Ring settings']), tuple(row['Start positions']), row['Reflector'],
+                   [(pair[0], pair[1]) for pair in row['Plugboard switches'].split()])
+        settings.append(setting + (row['Thin wheel'],) if row['Thin wheel'] else setting)
+    return settings
+
+
+# functions of the batch and stream engines, shared by Enigma M3.py, Enigma M4.py and the attacks
+STREAM_TABLE = str.maketrans({' ': 'X', '\n': 'X', ',': 'QQ'})                                     # Same replacements as prep_text(), line breaks count as spaces
+ROTOR_TABLES = np.array([(ROTORS[r].forward, ROTORS[r].backward) for r in sorted(ROTORS)], dtype=np.uint8)    # Compiled rotors, indexed by [rotor - 1, direction, offset, letter]
+NOTCH_TABLES = np.array([[i in ROTORS[r].notches for i in range(26)] for r in sorted(ROTORS)], dtype=np.intp).ravel()    # Notches of the rotors, indexed by (rotor - 1) * 26 + position
+
+
+def step_positions(rotors, starts, length):                                                        # Positions of many setups (rows) at every key press (columns), same stepping as step_rotors() and RotorSchedule
+    # rotors is one rotor order for all the rows, or one order per row. starts holds the left, centre and right start
+    # positions of each row as integers. The result is indexed by [rotor, row, key press].
+    rotors = np.broadcast_to(np.asarray(rotors, dtype=np.intp) - 1, (len(starts), 3))
+    centre_notch, right_notch = rotors[:, 1] * 26, rotors[:, 2] * 26
+    left, centre, right = (np.array(starts, dtype=np.intp)[:, i] for i in range(3))
+    positions = np.empty((3, len(starts), length), dtype=np.intp)
+    for i in range(length):
+        centre_step = NOTCH_TABLES[centre_notch + centre]
+        right_step = NOTCH_TABLES[right_notch + right]
+        left = (left + centre_step) % 26
+        centre = (centre + centre_step + right_step) % 26
+        right = (right + 1) % 26
+        positions[:, :, i] = left, centre, right
+    return positions
+
+
+def core_table(rotors, reflector_type):                                                            # Rotors and reflector (no plugboard) for every offset, indexed by [left, centre, right, letter]
+    (left_forward, left_backward), (centre_forward, centre_backward), (right_forward, right_backward) = (ROTOR_TABLES[r - 1] for r in rotors)
+    reflector = np.array(REFLECTORS[reflector_type].table, dtype=np.uint8)
+    l, c, r, x = np.ix_(*[np.arange(26)] * 4)
+    return right_backward[r, centre_backward[c, left_backward[l, reflector[left_forward[l, centre_forward[c, right_forward[r, x]]]]]]]
+
+
+def batch_encrypt(texts, settings, reflectors, thin_wheel=None):                                 # Encrypt N messages, each one with its own (rotors, ring_setting, start_positions, reflector_type, switches, ...)
+    # thin_wheel(settings) gives the fixed [message, direction, letter] permutations of the M4 thin wheels, applied on
+    # each side of the reflector. The three stepping rotors are the last three of the ring settings and start positions.
+    if len(texts) != len(settings):
+        raise ValueError(f'Got {len(texts)} messages but {len(settings)} settings')
+    for n, text in enumerate(texts):
+        if not set(text) <= set(AZ):
+            raise ValueError(f'Message {n} has characters other than A-Z, prepare it with prep_text() and upper()')
+    if not texts:
+        return []
+    rotors = np.array([s[0] for s in settings], dtype=np.intp)
+    ring_setting = np.array([[AZ.index(l) for l in s[1][-3:]] for s in settings], dtype=np.intp)
+    start_positions = np.array([[AZ.index(l) for l in s[2][-3:]] for s in settings], dtype=np.intp)
+    reflector_tables = np.array([[AZ.index(l) for l in reflectors[s[3]]] for s in settings], dtype=np.intp)
+    plugs = np.array([compile_plugboard(s[4]) for s in settings], dtype=np.intp)
+
+    lengths = [len(text) for text in texts]
+    length = max(lengths)
+    letters = np.zeros((len(texts), length), dtype=np.intp)                                        # Messages padded with A to the longest one, the padding is cut off at the end
+    for n, text in enumerate(texts):
+        letters[n, :len(text)] = np.frombuffer(text.encode('ascii'), dtype=np.uint8) - ord('A')
+
+    positions = step_positions(rotors, start_positions, length)
+    offsets = (positions - ring_setting.T[:, :, None]) % 26
+    l, c, r = offsets
+    left, centre, right = (rotors[:, i, None] - 1 for i in range(3))
+    messages = np.arange(len(texts))[:, None]
+
+    x = plugs[messages, letters]
+    x = ROTOR_TABLES[right, 0, r, x]
+    x = ROTOR_TABLES[centre, 0, c, x]
+    x = ROTOR_TABLES[left, 0, l, x]
+    if thin_wheel is None:
+        x = reflector_tables[messages, x]
+    else:
+        thin_wheels = thin_wheel(settings)
+        x = thin_wheels[messages, 1, reflector_tables[messages, thin_wheels[messages, 0, x]]]
+    x = ROTOR_TABLES[left, 1, l, x]
+    x = ROTOR_TABLES[centre, 1, c, x]
+    x = ROTOR_TABLES[right, 1, r, x]
+    x = plugs[messages, x]
+
+    enc_texts = []
+    for n, enc_letters in enumerate((x + ord('A')).astype(np.uint8)):
+        enc_text = enc_letters[:lengths[n]].tobytes().decode('ascii')
+        enc_texts.append(' '.join([enc_text[i:i + 5] for i in range(0, len(enc_text), 5)]))
+    return enc_texts
+
+
+def read_chunks(source, chunk_size):                                                               # Text of a file or pipe, chunk_size characters at a time, prepared like prep_text()
+    while True:
+        chunk = source.read(chunk_size)
+        if not chunk:
+            return
+        yield re.sub('[^A-Z]', '', chunk.translate(STREAM_TABLE).upper())
+
+
+def group_letters(letters, written):                                                                # 5-letter groups of a chunk that follows written letters, completing the group left open by the previous chunk
+    head = -written % 5
+    groups = letters[:head] + ''.join(' ' + letters[i:i + 5] for i in range(head, len(letters), 5))
+    return groups[1:] if written == 0 else groups
+
+
+def stream_encrypt(source, sink, setting, batch, chunk_size, pieces):                              # Encrypt a file or pipe in constant memory with batch(texts, settings), writing the ciphertext as each chunk is done
+    rotors, ring_setting, start_positions = setting[:3]
+    schedule = RotorSchedule(rotors, start_positions)
+    presses = 0
+    for chunk in read_chunks(source, chunk_size):
+        if not chunk:                                                                              # A chunk of punctuation only leaves no letters
+            continue
+        size = -(-len(chunk) // pieces)                                                            # Each chunk is cut in pieces that batch() encrypts side by side
+        offsets = range(0, len(chunk), size)
+        settings = [(rotors, ring_setting, schedule.seek(presses + i)) + tuple(setting[3:]) for i in offsets]
+        enc_texts = batch([chunk[i:i + size] for i in offsets], settings)
+        sink.write(group_letters(''.join(enc_text.replace(' ', '') for enc_text in enc_texts), presses))
+        sink.flush()
+        presses += len(chunk)
+    return presses
@@ -0,0 +1,174 @@
+#/usr/bin/env python3
+"""
+INDICATOR ANALYSIS OF THE ENIGMA M3 WITH ZYGALSKI SHEETS
+Until May 1940 the operators enciphered the message key twice: they chose a ground setting, sent it in clear, then
+typed the three letters of the message key twice from it. The six letters of the indicator are the same key letter
+encrypted by the permutations P1 and P4 (or P2 and P5, P3 and P6). When two of them are equal, a "female", P4.P1 has a
+fixed point. The plugboard does not change that: it only renames the letters of the fixed point.
+
+Henryk Zygalski punched a sheet for each rotor order and left rotor position, with a hole at each centre and right
+position where a female could occur. Laying the sheets of a day's females over one another, shifted by their ground
+settings, only the holes of the right rotor order and ring setting stay open.
+
+The sheets here are computed from the rotor cores of every rotor order and reflector, one bit per right rotor offset,
+packed in 32-bit words. Unlike the paper sheets they also know when the centre rotor turns over between the two letters
+of a female, since the turnovers only depend on the ground setting. The intersection is a vectorized AND of the words
+over all rotor orders at once.
+https://en.wikipedia.org/wiki/Zygalski_sheet
+https://www.cryptomuseum.com/crypto/enigma/zygalski.htm
+"""
+
+import os
+import secrets
+from string import ascii_uppercase as AZ
+from itertools import permutations
+from time import perf_counter
+import sys
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))                                      # Enigma_Machine.py sits next to this script, also when it is loaded from another directory
+from Enigma_Machine import REFLECTOR, Machine, RotorSchedule, core_table
+
+
+INDICATORS = []                # (ground setting, enciphered doubled key) pairs of one day, like ('QTR', 'JGWJKM')
+INDICATORS_PATH = None         # Text file with one indicator per line instead, ground setting then the six letters
+
+SHEET_ROTORS = (1, 2, 3, 4, 5) # Rotors of the sheets: the Army and Air Force rotors, add 6, 7 and 8 for the naval traffic
+SHEETS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'zygalski_sheets.npy')    # 2.6 MB for the 60 rotor orders, built once in about 10 seconds
+BENCHMARK = False
+
+ORDERS = list(permutations(SHEET_ROTORS, 3))
+FULL = np.uint32((1 << 26) - 1)
+STEPS = [(left, centre) for left in (0, 1) for centre in (0, 1, 2, 3)]    # Steps of the left and centre rotors between the letters of a female
+STEP_INDEX = np.full((26, 26), -1, dtype=np.int64)
+for n, (left, centre) in enumerate(STEPS):
+    STEP_INDEX[left, centre] = n
+SHEETS = {}                    # Sheets loaded from SHEETS_PATH, by path
+
+
+# functions of the sheets
+def build_sheets(path=SHEETS_PATH, verbose=True):
+    # Word [order, reflector, steps, left, centre] has bit j set when a female is possible with the right offset (-j) % 26
+    # at the first letter. The reversed bit order lets a left rotation by the ground setting give the bit of each ring.
+    sheets = np.lib.format.open_memmap(path, mode='w+', dtype=np.uint32, shape=(len(ORDERS), len(REFLECTOR), len(STEPS), 26, 26))
+    l, c, r = np.ix_(np.arange(26), np.arange(26), np.arange(26))
+    weights = (np.uint32(1) << ((-np.arange(26)) % 26).astype(np.uint32))
+    begin = perf_counter()
+    for n, rotors in enumerate(ORDERS):
+        for m, reflector_type in enumerate(REFLECTOR):
+            core = core_table(rotors, reflector_type)
+            for s, (left_steps, centre_steps) in enumerate(STEPS):
+                later = core[(l + left_steps) % 26, (c + centre_steps) % 26, (r + 3) % 26]
+                female = (np.take_along_axis(later, core, axis=3) == np.arange(26)).any(axis=3)    # P4.P1 has a fixed point
+                sheets[n, m, s] = (female * weights).sum(axis=2, dtype=np.uint32)
+        if verbose:
+            print(f'\r[+] Zygalski sheets {n + 1}/{len(ORDERS)}, {perf_counter() - begin:.1f}s', end='\r', flush=True)
+    if verbose:
+        print()
+    sheets.flush()
+    return sheets
+
+
+def load_sheets(path=SHEETS_PATH):
+    if path not in SHEETS:
+        if os.path.exists(path):
+            sheets = np.load(path, mmap_mode='r')
+            if sheets.shape != (len(ORDERS), len(REFLECTOR), len(STEPS), 26, 26):                 # Built for other SHEET_ROTORS
+                del sheets
+                sheets = build_sheets(path)
+        else:
+            sheets = build_sheets(path)
+        SHEETS[path] = np.asarray(sheets)
+    return SHEETS[path]
+
+
+# functions of the indicators
+def read_indicators(path):
+    with open(path) as f:
+        return [tuple(line.split()[:2]) for line in f if line.strip()]
+
+
+def females(indicators):                                                                          # (ground setting, first letter of the female) for each repeated letter
+    found = []
+    for ground, key in indicators:
+        ground, key = ground.upper(), key.upper()
+        for k in range(3):
+            if key[k] == key[k + 3]:
+                found.append((ground, k))
+    return found
+
+
+def female_rows(sheets, ground, k):                                                               # Sheet words of one female for every rotor order, reflector and left and centre rings
+    first = np.array([[AZ.index(p) for p in RotorSchedule(rotors, ground)[k]] for rotors in ORDERS])
+    later = np.array([[AZ.index(p) for p in RotorSchedule(rotors, ground)[k + 3]] for rotors in ORDERS])
+    steps = STEP_INDEX[(later[:, 0] - first[:, 0]) % 26, (later[:, 1] - first[:, 1]) % 26]
+    rings = np.arange(26)
+    left = (first[:, 0, None] - rings) % 26                                                      # Offset of each ring at the first letter
+    centre = (first[:, 1, None] - rings) % 26
+    rows = sheets[np.arange(len(ORDERS))[:, None, None, None], np.arange(len(REFLECTOR))[None, :, None, None],
+                  steps[:, None, None, None], left[:, None, :, None], centre[:, None, None, :]]
+    shift = first[:, 2].astype(np.uint32)[:, None, None, None]
+    return ((rows << shift) | (rows >> (np.uint32(26) - shift))) & FULL                          # Bit of the right ring
+
+
+def intersect(female_list, sheets=None):                                                          # Words of the ring settings that explain every female: [order, reflector, left ring, centre ring]
+    sheets = load_sheets() if sheets is None else sheets
+    mask = np.full((len(ORDERS), len(REFLECTOR), 26, 26), FULL, dtype=np.uint32)
+    for ground, k in female_list:
+        mask &= female_rows(sheets, ground, k)
+    return mask
+
+
+def candidates(indicators, sheets=None, limit=100):
+    mask = intersect(females(indicators), sheets)
+    reflectors = list(REFLECTOR)
+    found = []
+    for n, m, l, c in zip(*np.nonzero(mask)):
+        word = int(mask[n, m, l, c])
+        for r in range(26):
+            if word >> r & 1:
+                found.append({'Rotors': ORDERS[n], 'Reflector': reflectors[m], 'Ring setting': (AZ[l], AZ[c], AZ[r])})
+                if len(found) == limit:
+                    return found
+    return found
+
+
+# functions of the benchmark
+def random_key(length=3):
+    return ''.join(secrets.choice(AZ) for i in range(length))
+
+
+def day_traffic(messages, rotors, reflector_type, ring_setting, switches):                       # Indicators of a day: ground setting in clear, then the message key typed twice
+    machine = Machine(rotors, reflector_type, ring_setting, switches)
+    indicators = []
+    for i in range(messages):
+        ground, key = random_key(), random_key()
+        indicators.append((ground, machine.encrypt(key * 2, ground)))
+    return indicators
+
+
+def benchmark(messages=(50, 100, 200), switches=10):
+    begin = perf_counter()
+    sheets = load_sheets()
+    print(f'[+] Sheets loaded in {perf_counter() - begin:.1f}s')
+    for count in messages:
+        rotors = tuple(secrets.SystemRandom().sample(SHEET_ROTORS, 3))
+        reflector_type = secrets.choice(list(REFLECTOR))
+        ring_setting = random_key()
+        letters = secrets.SystemRandom().sample(AZ, 2 * switches)
+        indicators = day_traffic(count, rotors, reflector_type, ring_setting, list(zip(letters[::2], letters[1::2])))
+        begin = perf_counter()
+        found = candidates(indicators, sheets, limit=None)
+        elapsed = perf_counter() - begin
+        real = {'Rotors': rotors, 'Reflector': reflector_type, 'Ring setting': tuple(ring_setting)}
+        print(f'{count} messages, {len(females(indicators))} females: {len(found)} candidates in {elapsed:.2f}s, real setting found: {real in found}')
+
+
+if __name__ == '__main__':
+    if BENCHMARK:
+        benchmark()
+    else:
+        indicators = read_indicators(INDICATORS_PATH) if INDICATORS_PATH else INDICATORS
+        print(f'[+] {len(females(indicators))} females in {len(indicators)} indicators')
+        for candidate in candidates(indicators):
+            print(candidate)
@@ -2,7 +2,7 @@
 # /usr/bin/env python3
 """
 A set of functions to analyze Egniam ciphertext, based on the logic of the TURING-WELCHMAN Bombe (crib -> menu -> scan rotor's setup for valid plugboard combinations).
-I wrote a tool to play with this historical cipher rather than simulating the original Bombe (e.g. no rotor banks, no diagonal board).
+I wrote a tool to play with this historical cipher rather than simulating the original Bombe (e.g. no rotor banks), though the test register follows the diagonal board of Welchman.
 The Enigma ciphertexts are short so I did not use statistics. It could be faster indeed (e.g. replace linear search and use generators).
 
 I link my sources for inspiration:
@@ -18,51 +18,61 @@ https://www.101computing.net/turing-welchman-bombe/
 from collections import deque
 from string import ascii_uppercase as AZ
 from string import punctuation
-from copy import copy
-from itertools import permutations
-from time import process_time
+from itertools import permutations, product, islice
+from time import process_time, perf_counter
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
 import re
+import os
+import sys
+import sqlite3
+import hashlib
+import json
+import cProfile
+import pstats
+import tracemalloc
+from contextlib import contextmanager
+from types import ModuleType
 from pprint import pprint
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))                                      # Enigma_Machine.py sits next to this script, also when it is loaded from another directory
+from Enigma_Machine import REFLECTOR, COMPOSITE_REFLECTOR, TURN_NOTCH, ROTOR_TABLES, Machine, Plugboard, RotorSchedule, set_rotors, step_rotors, Cesar, step_positions, core_table
+from Enigma_Ciphertext_Only import load_ngrams, to_ints
 
 
 CIPHERTEXT = 'Type your ciphertext here...'
 TEXT_FRAGMENT = 'Type here a possible plaintext fragment'
 
 
-INNER_RING = {1: 'EKMFLGDQVZNTOWYHXUSPAIBRCJ',
-              2: 'AJDKSIRUXBLHWTMCQGZNPYFVOE',
-              3: 'BDFHJLCPRTXVZNYEIWGAKMUSQO',
-              4: 'ESOVPZJAYQUIRHXLNFTGKDCMWB',
-              5: 'VZBRGITYUPSDNHLXAWMJQOFECK',
-              #6: 'JPGVOUMFYQBENHZRDKASXLICTW',
-              #7: 'NZJHGRCXMYSWBOUFAIVLPEKQDT',
-              #8: 'FKQHTLXOCBJSPDZRAMEWNIUYGV'
-             }
-
-REFLECTOR = {'UKW_B': 'YRUHQSLDPXNGOKMIEBFZCWVJAT',
-             'UKW_C': 'FVPJIAOYEDRZXWGCTKUQSBNMHL'}
-
-TURN_NOTCH = {1: 'Q',                     # If rotor steps from Q to R, the next rotor is advanced
-              2: 'E',	                  # If rotor steps from E to F, the next rotor is advanced
-              3: 'V',	                  # If rotor steps from V to W, the next rotor is advanced
-              4: 'J',	                  # If rotor steps from J to K, the next rotor is advanced
-              5: 'Z',	                  # If rotor steps from Z to A, the next rotor is advanced 
-              #6: ['Z', 'M'],              # If rotor steps from Z to A, or from M to N the next rotor is advanced
-              #7: ['Z', 'M'],              # If rotor steps from Z to A, or from M to N the next rotor is advanced
-              #8: ['Z', 'M']               # If rotor steps from Z to A, or from M to N the next rotor is advanced
-             }
-              
-ROTOR_NAME = {1: 'I',
-              2: 'II',
-              3: 'III',
-              4: 'IV',
-              5: 'V',
-              #6: 'VI',
-              #7: 'VII',
-              #8: 'VIII'
-             }
-
 DEBUG = True
+BOMBE_ROTORS = (1, 2, 3, 4, 5, 6, 7, 8)   # Rotors of the scans: I-V for Army and Luftwaffe traffic (60 orders), VI-VIII too for the Kriegsmarine (336 orders)
+M4 = False                                # Scan M4 traffic: each thin reflector, thin wheel and thin wheel offset is one of 2 x 2 x 26 composite reflectors
+MAX_LOOP_LENGTH = 4                       # Longest loop of the menu, None for all the simple cycles
+DIAGONAL_BOARD = True                     # Test the rotor setups by propagating plugboard hypotheses through the menu, instead of enumerating loop letters
+CIPHERTEXT_FILE = None                    # Path to a file with one ciphertext per line, to run the Bombe without interaction
+WORKERS = None                            # Processes of the parallel scan, None for one per CPU core
+SHARDS_IN_FLIGHT = 4                      # Shards submitted to the pool at a time per worker, bounds the memory of the futures on large scans
+CORE_TABLES = False                       # Look up the scramblers in the precomputed rotor cores (about 55 MB on disk for rotors I-V, 307 MB for I-VIII)
+CORE_TABLES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'bombe_cores.npy')
+STAGE_METRICS = {}                        # Timings and counters of each stage, filled by measure()
+OPEN_STAGES = []
+RESULTS_INDEX = None                      # SQLite file where scan() records the stops and the completed shards, so that an interrupted scan resumes
+CHECKPOINT_SECONDS = 30                   # Longest time between two commits of the results index
+METRICS_PATH = None                       # JSON file where Bombe_pipeline() exports the timings and counters of each stage
+PROFILE = None                            # 'cprofile' or 'tracemalloc' to profile the measured stages as well, None to only time them
+PROFILE_STAGES = None                     # Names of the stages to profile, None for all of them
+PROFILE_TOP = 15                          # Functions (cProfile) or source lines (tracemalloc) kept in the profile of a stage
+BATCH_VERIFY = True                       # Verify the plugboards of all the stops of a crib together with verify_batch(), instead of decode() one by one
+VERIFY_TOP = 10                           # Best setups kept by verify_batch(), ranked by crib matches then by the bigram score of the whole message
+VERIFY_MIN_RATIO = 0.6                    # Share of the crib letters a setup must restore to be scored on the whole message
+VERIFY_BATCH = 4096                       # Setups decrypted together by verify_batch(), bounds its memory
+WIRINGS = {**REFLECTOR, **COMPOSITE_REFLECTOR}                                                   # Every reflector a stop can name, the M4 composites included
+
+
+def bombe_reflectors():                                                                          # Reflectors of the scans
+    return COMPOSITE_REFLECTOR if M4 else REFLECTOR
+
+
 DEBUG_SOLUTION = {'Rotors': (1, 2, 3),
                   'Reflector': 'UKW_B',
                   'Start': ('A', 'B', 'C'),
@@ -78,15 +88,11 @@ def Turing_Bombe(word, enc_text):
     if crib_index not in valid_cipher_positions:
         print('The number you entered is not in the list')
         return None
-    cipher_fragment = cipher[crib_index : crib_index + len(word)]                                               # Create the ciphertext fragment of the crib to analyze
-    crib = dict(zip(range(len(word)), [''.join(j) for j in list(zip(word, cipher_fragment))]))                  # Create a dict with crib positions as key and plain/cipher pairs as values      
-    menu = []
-    for letter in AZ:
-        loops = prune(menu_analysis(crib, letter))                                                              # Create a list of loops for each letter in the alphabet 
-        if len(loops) > 0:
-            for loop in loops:
-                menu.append([letter, loop])                                                                     # List letters for which at leats one loop exists                
-    menu = dict(zip(range(len(menu)), menu))
+    cipher_fragment, crib = crib_stage(word, enc_text, crib_index)
+    menu, quality = menu_stage(crib)
+    print(f"[+] Menu quality {quality['Quality']} (closures), components:")
+    for component in quality['Components']:
+        print(f"    {component['Letters']}: {component['Edges']} edges, {component['Closures']} closures")
 
     i = input('Scan rotor combinations [y/n]? ')
     assert((i.upper() == 'Y') or (i.upper() == 'N'))
@@ -121,7 +127,7 @@ def Turing_Bombe(word, enc_text):
     for loop in refined_menu:
         switches = find_plugboard_combinations(rotors, loop[1], crib, reflector, start, ring_setting, True)
         if switches:
-            plugboards = build_plugboard(switches, plugboards)
+            plugboards = build_plugboard(plugboards, switches)
     
     print()
     for plugboard in plugboards:
@@ -133,6 +139,156 @@ def Turing_Bombe(word, enc_text):
         print(result)
 
 
+def crib_stage(word, enc_text, crib_index):
+    with measure('crib'):
+        cipher_fragment = enc_text[crib_index : crib_index + len(word)]                                         # Create the ciphertext fragment of the crib to analyze
+        crib = dict(zip(range(len(word)), [''.join(j) for j in list(zip(word, cipher_fragment))]))              # Create a dict with crib positions as key and plain/cipher pairs as values
+        count(candidates=1)
+    return cipher_fragment, crib
+
+
+def menu_stage(crib):                                                                                           # Loops of the menu, and its components and quality
+    with measure('menu'):
+        menu = [[AZ[cycle[0][0]], [(AZ[a] + AZ[b], j) for a, b, j in cycle]] for cycle in menu_cycles(crib)]    # Each loop is listed once, from its smallest letter
+        quality = menu_quality(crib)
+        count(candidates=len(menu))
+    return dict(zip(range(len(menu)), menu)), quality
+
+
+def scan_stage(word, cipher_fragment, crib, menu, ring_setting=('A', 'A', 'A'), candidates=10, ring_scan=False, **scan_options):    # Scan with the shortest loop of the menu and keep the best stops
+    loop = min(menu.values(), key=lambda x : len(x[1]))[1]
+    shard = ring_scan_shard if ring_scan else scan_shard
+    with measure('rotor scan'):
+        stops = list(scan(word, cipher_fragment, crib, loop, ring_setting, shard=shard, **scan_options))
+        count(candidates=len(stops))
+    stops.sort(key=lambda x : x['Matches'], reverse=True)
+    return stops[:candidates]
+
+
+def plugboard_stage(stop, menu, crib):                                                                          # Plugboards consistent with all the loops of the menu, at the rotor setup of a stop
+    with measure('plugboard'):
+        plugboards = stop_plugboards(stop, menu, crib)
+        count(positions=1, candidates=len(plugboards))
+    return plugboards
+
+
+def stop_plugboards(stop, menu, crib):
+    if DIAGONAL_BOARD:                                                                                          # The test register already covers every constraint of the crib
+        return diagonal_board(stop['Rotors'], crib, stop['Reflector'], stop['Start'], stop['Ring setting']) or []
+    plugboards = []
+    for loop in menu.values():
+        switches = find_plugboard_combinations(stop['Rotors'], loop[1], crib, stop['Reflector'], stop['Start'], stop['Ring setting'], False)
+        if not switches:                                                                                        # A loop without consistent switches rejects the stop
+            return []
+        plugboards = build_plugboard(plugboards, switches)
+    return plugboards
+
+
+def verify_stage(stop, plugboards, cipher_fragment, word):
+    with measure('verify'):
+        results = [decode(stop['Rotors'], stop['Reflector'], stop['Start'], stop['Ring setting'], plugboard, cipher_fragment, word) for plugboard in plugboards]
+        count(positions=len(plugboards), candidates=len(results))
+    results.sort(key=lambda x : x['Matches'], reverse=True)
+    return results
+
+
+def batch_verify_stage(candidates, enc_text, word, crib_index):                                               # Like verify_stage(), for the (stop, plugboard) pairs of all the stops at once
+    with measure('verify'):
+        results = verify_batch(candidates, enc_text, word, crib_index)
+        count(positions=len(candidates), candidates=len(results))
+    return results
+
+
+def Bombe_pipeline(word, enc_text, crib_indexes=None, max_cribs=1, ring_setting=('A', 'A', 'A'), candidates=10, ring_scan=False, **scan_options):
+    if crib_indexes is None:
+        crib_indexes = crib_table(enc_text, [word])[word].tolist()
+    results = []
+    processed = 0
+    for crib_index in crib_indexes:
+        if max_cribs is not None and processed >= max_cribs:                                                    # max_cribs=None analyzes all the crib positions
+            break
+        cipher_fragment, crib = crib_stage(word, enc_text, crib_index)
+        menu, quality = menu_stage(crib)
+        if not menu:                                                                                            # Without loops the scan cannot reject any rotor setup
+            continue
+        stops = scan_stage(word, cipher_fragment, crib, menu, ring_setting, candidates, ring_scan, **scan_options)
+        if BATCH_VERIFY:
+            verified = batch_verify_stage([(stop, plugboard) for stop in stops for plugboard in plugboard_stage(stop, menu, crib)], enc_text, word, crib_index)
+        else:
+            verified = [result for stop in stops for result in verify_stage(stop, plugboard_stage(stop, menu, crib), cipher_fragment, word)]
+        for result in verified:
+            result['Crib index'] = crib_index
+            result['Menu quality'] = quality['Quality']
+            result['Menu components'] = quality['Components']
+            if ring_scan:
+                with measure('rings'):
+                    settings = resolve_rings(result, enc_text, crib_index)
+                    count(positions=26 * 26, candidates=len(settings))
+                result['Message setting'] = settings[0]
+            results.append(result)
+        processed += 1
+    results.sort(key=lambda x : (x['Matches'], x.get('Score', 0)), reverse=True)
+    if METRICS_PATH:
+        export_metrics(METRICS_PATH)
+    return results
+
+
+def index_of_coincidence(text):
+    n = len(text)
+    return sum(text.count(l) * (text.count(l) - 1) for l in AZ) / (n * (n - 1)) if n > 1 else 0
+
+
+def decrypt_message(rotors, reflector, start, ring_setting, switches, enc_text):          # Decrypt a whole message with the integer scramblers
+    schedule = RotorSchedule(rotors, start)
+    plug = (switches or Plugboard()).table
+    return ''.join(AZ[plug[scrambler(rotors, reflector, schedule[n], ring_setting)[plug[AZ.index(l)]]]] for n, l in enumerate(enc_text))
+
+
+def message_start(rotors, positions, presses):                                            # Start positions of the message that reach positions after the given key presses
+    right = AZ[(AZ.index(positions[2]) - presses) % 26]
+    turnovers = RotorSchedule(rotors, ('A', 'A', right)).turnovers(presses)[0]
+    centre = AZ.index(positions[1])
+    double_steps = 0                                                                       # The centre rotor double stepped once from each notch it left, so count the notches back from its end position
+    while True:
+        steps = turnovers + double_steps
+        visits = sum((steps - (centre - 1 - AZ.index(n)) % 26 - 1) // 26 + 1 for n in TURN_NOTCH[rotors[1]] if steps > (centre - 1 - AZ.index(n)) % 26)
+        if visits == double_steps:
+            break
+        double_steps = visits
+    for double_steps in sorted(range(turnovers + 2), key=lambda d: abs(d - double_steps)):    # A turnover and a double step at the same press can shift the count, so check it and its neighbours
+        start = (AZ[(AZ.index(positions[0]) - double_steps) % 26], AZ[(centre - turnovers - double_steps) % 26], right)
+        if RotorSchedule(rotors, start).seek(presses) == tuple(positions):
+            return start
+    return None                                                                            # No start reaches these positions, the double step skips them
+
+
+def resolve_rings(stop, enc_text, crib_index):                                            # Rank the centre and right ring settings by the index of coincidence of the whole decrypted message
+    first_letter = RotorSchedule(stop['Rotors'], stop['Start'])[0]                        # Compare the cores at the first crib letter, a turnover at the first key press only shifts the start
+    offsets = [(AZ.index(p) - AZ.index(r)) % 26 for p, r in zip(first_letter, stop['Ring setting'])]
+    settings = []
+    for ring_centre in AZ:
+        for ring_right in AZ:
+            ring_setting = ('A', ring_centre, ring_right)                                  # The left ring cannot be told apart from the left start position
+            positions = tuple(AZ[(o + AZ.index(r)) % 26] for o, r in zip(offsets, ring_setting))
+            start = message_start(stop['Rotors'], positions, crib_index + 1)
+            if start is None:                                                              # No start reaches these positions, score the message from the second crib letter on
+                count(missed_starts=1)
+                text = decrypt_message(stop['Rotors'], stop['Reflector'], positions, ring_setting, stop['Plugboard'], enc_text[crib_index + 1:])
+            else:
+                text = decrypt_message(stop['Rotors'], stop['Reflector'], start, ring_setting, stop['Plugboard'], enc_text)
+            settings.append({'Start': start, 'Ring setting': ring_setting, 'IoC': index_of_coincidence(text), 'Text': text})
+    settings.sort(key=lambda x : (x['Start'] is not None, x['IoC']), reverse=True)         # The IoC of a partial message is not comparable, rank those last
+    return settings
+
+
+def Bombe_headless(path, word, **pipeline_options):                                                             # Run the whole pipeline on a file with one ciphertext per line
+    with open(path, 'r') as file:
+        for n, line in enumerate(file):
+            enc_text = line.strip().replace(' ', '').upper()
+            if len(enc_text) >= len(word):
+                yield n, Bombe_pipeline(word, enc_text, **pipeline_options)
+
+
 def build_plugboard(plugboards, switches):
     if len(plugboards) == 0:
         for s in switches:
@@ -140,8 +296,9 @@ def build_plugboard(plugboards, switches):
     else:
         for s in switches:
             for i, plugboard in enumerate(plugboards):
-                if check_switch_pairs(s, plugboard):
-                    plugboards[i] = s.union(plugboard)
+                merged = plugboard.merge(s)
+                if merged is not None:
+                    plugboards[i] = merged
     return plugboards
 
 
@@ -153,22 +310,24 @@ def scan_start(word, cipher_fragment, menu, crib, rotors, reflector):
         pprint(menu)
         n = int(input('Choose a loop to scan: '))
         setup = []
-        if start_combinations:
-            for start in start_combinations:
-                print(f'\r[+] Testing start positions {start}', end='\r', flush=True)
-                switches = find_plugboard_combinations(rotors, menu[n][1], crib, reflector, start, ring_setting, False)
-                if switches:
-                    for switch in switches:
-                        setup.append(decode(rotors, reflector, start, ring_setting, switch, cipher_fragment, word))
-        else:
-            for i in AZ:
-                for j in AZ:
-                    start= ('Z', i, j)
+        with measure('start scan'):
+            if start_combinations:
+                for start in start_combinations:
                     print(f'\r[+] Testing start positions {start}', end='\r', flush=True)
                     switches = find_plugboard_combinations(rotors, menu[n][1], crib, reflector, start, ring_setting, False)
                     if switches:
                         for switch in switches:
                             setup.append(decode(rotors, reflector, start, ring_setting, switch, cipher_fragment, word))
+            else:
+                for i in AZ:
+                    for j in AZ:
+                        start= ('Z', i, j)
+                        print(f'\r[+] Testing start positions {start}', end='\r', flush=True)
+                        switches = find_plugboard_combinations(rotors, menu[n][1], crib, reflector, start, ring_setting, False)
+                        if switches:
+                            for switch in switches:
+                                setup.append(decode(rotors, reflector, start, ring_setting, switch, cipher_fragment, word))
+            count(positions=len(start_combinations) if start_combinations else 26 * 26, candidates=len(setup))
         setup.sort(key=lambda x : x['Matches'])
         setup = dict(zip(range(len(setup)), setup))        
         print('\n')
@@ -196,20 +355,20 @@ def scan_rotors(word, cipher_fragment, menu, crib):
     loop = list(menu.values())
     loop.sort(key=lambda x : len(x[1]))
     loop = loop[0]
-    if DEBUG:
-        begin = process_time()
     start = ('Z', 'Z', 'Z')
     ring_setting = ('A', 'A', 'A')
     setup = []
-    for rotors in permutations(range(1, 6), 3):
-        print(f'\r[+] Testing rotors {rotors}', end='\r', flush=True)
-        for reflector in REFLECTOR:
-            switches = find_plugboard_combinations(rotors, loop[1], crib, reflector, start, ring_setting, False)
-            if not switches:
-                setup.append(decode(rotors, reflector, start, ring_setting, switches, cipher_fragment, word))
-            else:
-                for switch in switches:
-                    setup.append(decode(rotors, reflector, start, ring_setting, switch, cipher_fragment, word))
+    with measure('rotor scan') as record:
+        for rotors in permutations(BOMBE_ROTORS, 3):
+            print(f'\r[+] Testing rotors {rotors}', end='\r', flush=True)
+            for reflector in bombe_reflectors():
+                switches = find_plugboard_combinations(rotors, loop[1], crib, reflector, start, ring_setting, False)
+                if not switches:
+                    setup.append(decode(rotors, reflector, start, ring_setting, switches, cipher_fragment, word))
+                else:
+                    for switch in switches:
+                        setup.append(decode(rotors, reflector, start, ring_setting, switch, cipher_fragment, word))
+        count(positions=len(list(permutations(BOMBE_ROTORS, 3))) * len(bombe_reflectors()), candidates=len(setup))
     setup.sort(key=lambda x : x['Matches'])
     setup = dict(zip(range(len(setup)), setup))
     print('\n')
@@ -225,18 +384,305 @@ def scan_rotors(word, cipher_fragment, menu, crib):
         else:
             print(i, setup[i])
     if DEBUG:
-        print('Scan time: {0}'.format(process_time() - begin))
+        print('Scan time: {0}'.format(record['CPU time']))
     i = int(input('Choose the rotors: '))
     return setup[i]['Rotors'], setup[i]['Reflector']
 
 
+def scan_shard(rotors, reflector, left, loop, crib, ring_setting, cipher_fragment, word):       # Test all the start positions of one rotor order and reflector, with the left rotor fixed
+    hits = []
+    for i in AZ:
+        for j in AZ:
+            start = (left, i, j)
+            if DIAGONAL_BOARD:
+                switches = diagonal_board(rotors, crib, reflector, start, ring_setting)
+            else:
+                switches = find_plugboard_combinations(rotors, loop, crib, reflector, start, ring_setting, False)
+            if switches:
+                for switch in switches:
+                    hits.append(decode(rotors, reflector, start, ring_setting, switch, cipher_fragment, word))
+    return hits
+
+
+def ring_scan_shard(rotors, reflector, left, loop, crib, ring_setting, cipher_fragment, word):  # Like scan_shard(), with the ring settings folded into the start positions
+    # The rotor core only depends on position - ring setting, so with rings at A the start positions already cover every core.
+    # The right ring only moves the turnover of the centre rotor: try one ring per distinct set of turnover indexes inside the crib.
+    # The centre ring is resolved afterwards from the whole message by resolve_rings().
+    hits = []
+    notches = [AZ.index(n) for n in TURN_NOTCH[rotors[2]]]
+    for i in AZ:
+        for j in AZ:
+            phases = {}
+            for ring_right in range(26):
+                right = (AZ.index(j) + ring_right) % 26
+                turnovers = tuple(k for k in range(len(crib)) if (right + k) % 26 in notches)
+                phases.setdefault(turnovers, ring_right)
+            for ring_right in phases.values():
+                start = (left, i, AZ[(AZ.index(j) + ring_right) % 26])
+                ring = ('A', 'A', AZ[ring_right])
+                switches = diagonal_board(rotors, crib, reflector, start, ring)
+                if switches:
+                    for switch in switches:
+                        hits.append(decode(rotors, reflector, start, ring, switch, cipher_fragment, word))
+    return hits
+
+
+def register_module():
+    # The workers receive scan_shard() pickled by reference to this module. The file name has a space, so when it is loaded
+    # with importlib under another name without adding it to sys.modules, register it here before the pool forks.
+    # With the spawn start method (Windows, macOS) the workers import the module again, so it must be importable by that name.
+    if __name__ not in sys.modules:
+        module = ModuleType(__name__)
+        module.__dict__.update(globals())
+        sys.modules[__name__] = module
+
+
+def scan(word, cipher_fragment, crib, loop, ring_setting=('A', 'A', 'A'), workers=WORKERS, rotor_orders=None, reflectors=None, left_positions=AZ, shard=scan_shard, index=RESULTS_INDEX):
+    shards = list(product(rotor_orders or permutations(BOMBE_ROTORS, 3), reflectors or bombe_reflectors(), left_positions))    # Non-interactive scan of (rotor order, reflector, start position) over a pool of processes
+    connection = open_index(index) if index else None
+    if connection:                                                                               # Resume: replay the stops of the shards already completed, scan only the others
+        key = scan_key(connection, word, cipher_fragment, loop, ring_setting, shard)
+        done = completed_shards(connection, key)
+        yield from stored_stops(connection, key, [s for s in shards if s in done])
+        remaining = [s for s in shards if s not in done]
+        count(cache_hits=len(shards) - len(remaining))
+        shards = remaining
+    count(positions=len(shards) * 26 * 26, cache_misses=len(shards) if connection else 0)                  # Start positions of the centre and right rotors tested by each shard
+    if CORE_TABLES:
+        core_tables()                                                                            # Build or load the cores before the pool forks, the workers inherit the mapping
+    register_module()
+    executor = ProcessPoolExecutor(max_workers=workers)
+    checkpoint = perf_counter()
+    try:
+        pending = iter(shards)
+        futures = {}
+        for rotors, reflector, left in islice(pending, (workers or os.cpu_count()) * SHARDS_IN_FLIGHT):
+            futures[executor.submit(shard, rotors, reflector, left, loop, crib, ring_setting, cipher_fragment, word)] = (rotors, reflector, left)
+        while futures:
+            done, _ = wait(futures, return_when=FIRST_COMPLETED)                                 # Yield the hits of each shard as soon as it completes, and submit one more in its place
+            for future in done:
+                hits = future.result()
+                if connection:
+                    record_shard(connection, key, futures[future], hits)
+                    if perf_counter() - checkpoint > CHECKPOINT_SECONDS:
+                        connection.commit()
+                        checkpoint = perf_counter()
+                del futures[future]
+                for rotors, reflector, left in islice(pending, 1):
+                    futures[executor.submit(shard, rotors, reflector, left, loop, crib, ring_setting, cipher_fragment, word)] = (rotors, reflector, left)
+                yield from hits
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)                                       # A caller that stops iterating does not wait for the rest of the keyspace
+        if connection:
+            connection.commit()                                                                  # Keep every shard completed so far, also on KeyboardInterrupt
+            connection.close()
+
+
+# functions of the batch verification
+REFLECTOR_TABLES = np.array([[AZ.index(l) for l in WIRINGS[r]] for r in WIRINGS], dtype=np.uint8)
+REFLECTOR_INDEX = {r: m for m, r in enumerate(WIRINGS)}
+
+
+def batch_decrypt(setups, cipher):                                                       # Decrypt cipher (integers) under every (rotors, reflector, start, ring setting, plugboard) setup, one row each
+    rotors = np.array([s[0] for s in setups], dtype=np.intp)
+    reflectors = REFLECTOR_TABLES[[REFLECTOR_INDEX[s[1]] for s in setups]]
+    starts = np.array([[AZ.index(p) for p in s[2]] for s in setups], dtype=np.intp)
+    rings = np.array([[AZ.index(r) for r in s[3]] for s in setups], dtype=np.intp)
+    plugs = np.array([(s[4] or Plugboard()).table for s in setups], dtype=np.uint8)
+    l, c, r = (step_positions(rotors, starts, len(cipher)) - rings.T[:, :, None]) % 26
+    k = np.arange(len(setups))[:, None]
+    left, centre, right = rotors[:, 0, None] - 1, rotors[:, 1, None] - 1, rotors[:, 2, None] - 1
+    x = plugs[k, cipher[None, :]]
+    x = ROTOR_TABLES[left, 0, l, ROTOR_TABLES[centre, 0, c, ROTOR_TABLES[right, 0, r, x]]]
+    x = reflectors[k, x]
+    x = ROTOR_TABLES[right, 1, r, ROTOR_TABLES[centre, 1, c, ROTOR_TABLES[left, 1, l, x]]]
+    return plugs[k, x]
+
+
+def verify_batch(candidates, enc_text, word, crib_index, top=VERIFY_TOP, min_ratio=VERIFY_MIN_RATIO, batch=VERIFY_BATCH):
+    # Decrypt the message up to the end of the crib under every (stop, plugboard) candidate and drop those that restore
+    # too few crib letters, then decrypt the whole message under the others and rank them by bigram score.
+    # A stop whose start no message start reaches is still verified, on the message from the crib on only.
+    cipher = to_ints(enc_text)
+    plain = to_ints(word)
+    setups = []
+    fragments = []
+    for stop, plugboard in candidates:                                                   # The stops are found on the crib fragment, go back to the start of the message
+        start = message_start(stop['Rotors'], stop['Start'], crib_index)
+        if start is None:
+            fragments.append((stop['Rotors'], stop['Reflector'], stop['Start'], stop['Ring setting'], plugboard, stop['Start']))
+        else:
+            setups.append((stop['Rotors'], stop['Reflector'], start, stop['Ring setting'], plugboard, stop['Start']))
+    count(missed_starts=len(fragments))
+    results = verify_setups(setups, cipher, plain, crib_index, min_ratio, batch)
+    for result in verify_setups(fragments, cipher[crib_index:], plain, 0, min_ratio, batch):
+        result['Message start'] = None
+        results.append(result)
+    results.sort(key=lambda x : (x['Matches'], x['Message start'] is not None, x['Score']), reverse=True)
+    return results[:top]
+
+
+def verify_setups(setups, cipher, plain, crib_index, min_ratio, batch):                  # Crib matches and bigram score of every setup on cipher, with the crib at crib_index
+    crib_end = crib_index + len(plain)
+    kept = []
+    for i in range(0, len(setups), batch):
+        block = setups[i:i + batch]
+        matches = (batch_decrypt(block, cipher[:crib_end])[:, crib_index:] == plain).sum(axis=1)
+        kept.extend((setup, int(m)) for setup, m in zip(block, matches) if m >= min_ratio * len(plain))
+    bigrams = load_ngrams()[0]
+    results = []
+    for i in range(0, len(kept), batch):
+        block = kept[i:i + batch]
+        texts = batch_decrypt([setup for setup, m in block], cipher).astype(np.intp)
+        scores = bigrams[texts[:, :-1] * 26 + texts[:, 1:]].mean(axis=1) if len(cipher) > 1 else np.zeros(len(block))
+        for (setup, m), text, score in zip(block, texts, scores):
+            rotors, reflector, start, ring_setting, plugboard, crib_start = setup
+            message = ''.join(AZ[x] for x in text)
+            results.append({'Rotors': rotors, 'Reflector': reflector, 'Start': crib_start, 'Ring setting': ring_setting, 'Matches': m, 'Plugboard': plugboard,
+                            'Text': message[crib_index:crib_end], 'Message start': start, 'Message': message, 'Score': float(score)})
+    return results
+
+
+# functions of the instrumentation
+@contextmanager
+def measure(stage):                                                                      # Time a stage and add it to STAGE_METRICS, profiling it when PROFILE is set
+    record = STAGE_METRICS.setdefault(stage, {'Calls': 0, 'Wall time': 0.0, 'CPU time': 0.0, 'Positions': 0, 'Candidates': 0, 'Cache hits': 0, 'Cache misses': 0, 'Missed starts': 0})
+    profiling = PROFILE if PROFILE_STAGES is None or stage in PROFILE_STAGES else None
+    if profiling == 'cprofile':
+        profiler = cProfile.Profile()
+        profiler.enable()
+    elif profiling == 'tracemalloc':
+        started = not tracemalloc.is_tracing()
+        if started:
+            tracemalloc.start()
+        tracemalloc.reset_peak()
+    OPEN_STAGES.append(record)
+    wall, cpu = perf_counter(), process_time()
+    try:
+        yield record
+    finally:
+        record['Wall time'] += perf_counter() - wall
+        record['CPU time'] += process_time() - cpu                                       # CPU time of this process only, the pool workers are not included
+        record['Calls'] += 1
+        OPEN_STAGES.pop()
+        if profiling == 'cprofile':
+            profiler.disable()
+            stats = sorted(pstats.Stats(profiler).stats.items(), key=lambda x : x[1][3], reverse=True)
+            record['Profile'] = [{'Function': f'{path}:{line}({function})', 'Calls': calls, 'Cumulative time': cumulative}
+                                 for (path, line, function), (_, calls, _, cumulative, _) in stats[:PROFILE_TOP]]
+        elif profiling == 'tracemalloc':
+            record['Peak memory'] = max(record.get('Peak memory', 0), tracemalloc.get_traced_memory()[1])
+            record['Allocations'] = [str(s) for s in tracemalloc.take_snapshot().statistics('lineno')[:PROFILE_TOP]]
+            if started:
+                tracemalloc.stop()
+
+
+def count(positions=0, candidates=0, cache_hits=0, cache_misses=0, missed_starts=0):     # Add to the counters of the innermost stage being measured, if any
+    if OPEN_STAGES:
+        record = OPEN_STAGES[-1]
+        record['Positions'] += positions
+        record['Candidates'] += candidates
+        record['Cache hits'] += cache_hits
+        record['Cache misses'] += cache_misses
+        record['Missed starts'] += missed_starts                                         # Stops verified without their message start, which no start position reaches
+
+
+def stage_metrics():                                                                     # STAGE_METRICS with the rates derived from the counters
+    metrics = {}
+    for stage, record in STAGE_METRICS.items():
+        metrics[stage] = dict(record)
+        metrics[stage]['Positions per second'] = record['Positions'] / record['Wall time'] if record['Wall time'] else 0.0
+        lookups = record['Cache hits'] + record['Cache misses']
+        metrics[stage]['Cache hit rate'] = record['Cache hits'] / lookups if lookups else None
+    return metrics
+
+
+def export_metrics(path):
+    with open(path, 'w') as file:
+        json.dump(stage_metrics(), file, indent=2)
+
+
+def reset_metrics():
+    STAGE_METRICS.clear()
+
+
+# functions of the results index
+def open_index(path):
+    connection = sqlite3.connect(path)
+    connection.executescript("""
+        CREATE TABLE IF NOT EXISTS scans (scan TEXT PRIMARY KEY, word TEXT, cipher_fragment TEXT, ring_setting TEXT, method TEXT);
+        CREATE TABLE IF NOT EXISTS shards (scan TEXT, rotors TEXT, reflector TEXT, left TEXT, stops INTEGER, PRIMARY KEY (scan, rotors, reflector, left));
+        CREATE TABLE IF NOT EXISTS stops (scan TEXT, shard_rotors TEXT, shard_reflector TEXT, shard_left TEXT,
+                                          rotors TEXT, reflector TEXT, start TEXT, ring_setting TEXT, matches INTEGER, plugboard TEXT, text TEXT);
+        CREATE INDEX IF NOT EXISTS stops_by_shard ON stops (scan, shard_rotors, shard_reflector, shard_left);
+        CREATE INDEX IF NOT EXISTS stops_by_matches ON stops (matches);
+    """)
+    return connection
+
+
+def scan_key(connection, word, cipher_fragment, loop, ring_setting, shard):                 # Scans with the same crib, loop, rings and method share their shards
+    method = f'{shard.__name__}, diagonal board' if DIAGONAL_BOARD else shard.__name__
+    key = hashlib.sha1(repr((word, cipher_fragment, loop, tuple(ring_setting), method)).encode()).hexdigest()
+    connection.execute('INSERT OR IGNORE INTO scans VALUES (?, ?, ?, ?, ?)', (key, word, cipher_fragment, ''.join(ring_setting), method))
+    return key
+
+
+def rotors_key(rotors):
+    return ','.join(str(r) for r in rotors)
+
+
+def completed_shards(connection, key):
+    rows = connection.execute('SELECT rotors, reflector, left FROM shards WHERE scan = ?', (key,))
+    return {(tuple(int(r) for r in rotors.split(',')), reflector, left) for rotors, reflector, left in rows}
+
+
+def record_shard(connection, key, shard, hits):                                             # The stops and the completion mark of a shard go in the same transaction
+    rotors, reflector, left = shard
+    connection.executemany('INSERT INTO stops VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                           [(key, rotors_key(rotors), reflector, left, rotors_key(hit['Rotors']), hit['Reflector'], ''.join(hit['Start']), ''.join(hit['Ring setting']),
+                             hit['Matches'], ' '.join(hit['Plugboard'] or []), hit['Text']) for hit in hits])
+    connection.execute('INSERT OR REPLACE INTO shards VALUES (?, ?, ?, ?, ?)', (key, rotors_key(rotors), reflector, left, len(hits)))
+
+
+def stop_from_row(rotors, reflector, start, ring_setting, matches, plugboard, text):
+    return {'Rotors': tuple(int(r) for r in rotors.split(',')), 'Reflector': reflector, 'Start': tuple(start), 'Ring setting': tuple(ring_setting),
+            'Matches': matches, 'Plugboard': Plugboard(plugboard.split()), 'Text': text}
+
+
+def stored_stops(connection, key, shards):
+    for rotors, reflector, left in shards:
+        rows = connection.execute('SELECT rotors, reflector, start, ring_setting, matches, plugboard, text FROM stops WHERE scan = ? AND shard_rotors = ? AND shard_reflector = ? AND shard_left = ?',
+                                  (key, rotors_key(rotors), reflector, left))
+        for row in rows.fetchall():
+            yield stop_from_row(*row)
+
+
+def query_index(path, word=None, min_matches=0, limit=100):                                 # Best stops recorded in the results index, without scanning again
+    connection = open_index(path)
+    query = ('SELECT scans.word, stops.rotors, stops.reflector, stops.start, stops.ring_setting, stops.matches, stops.plugboard, stops.text '
+             'FROM stops JOIN scans ON stops.scan = scans.scan WHERE stops.matches >= ?')
+    parameters = [min_matches]
+    if word is not None:
+        query += ' AND scans.word = ?'
+        parameters.append(word)
+    query += ' ORDER BY stops.matches DESC LIMIT ?'
+    parameters.append(limit)
+    results = []
+    for row in connection.execute(query, parameters).fetchall():
+        stop = stop_from_row(*row[1:])
+        stop['Word'] = row[0]
+        results.append(stop)
+    connection.close()
+    return results
+
+
 def decode(rotors, reflector, start, ring_setting, switch, cipher_fragment, word):
     left, centre, right = set_rotors(start, rotors)
     c = 0
     text = ''
     for index, letter in enumerate(cipher_fragment):
         left, centre, right = step_rotors(left, centre, right, rotors)
-        enc_letter = rotors_encoding(letter, ring_setting, reflector, left, centre, right, switch if switch else '')
+        enc_letter = rotors_encoding(letter, ring_setting, reflector, left, centre, right, switch or Plugboard())
         text += enc_letter
         if enc_letter == word[index]:
             c += 1
@@ -254,8 +700,7 @@ def find_plugboard_combinations(rotors, loop, crib, reflector, start, ring_setti
         if check_letter_combinations(letters_to_test, list(i[1] for i in loop), crib):
             switches = compile_switches(letters_to_test, [j for _, j in loop], rotors, reflector, start, ring_setting, crib)
             if switches:
-                switches = {''.join((min(i, j), max(i, j))) for i, j in switches}
-                valid_switches.append(switches)    
+                valid_switches.append(switches)
         for i in range(len(alphabets) - 1):
             if set(letters_to_test[i + 1:]) == {'Z'}:
                 alphabets[i].rotate(-1)
@@ -268,191 +713,172 @@ def find_plugboard_combinations(rotors, loop, crib, reflector, start, ring_setti
 
 
 def check_letter_combinations(letters_to_test, indexes, crib):
-    previous_pairs = []
+    pairs = Plugboard()
     for i, j in enumerate(indexes):
-        pair = [''.join((crib[j][0], letters_to_test[i]))]
-        if not check_switch_pairs(pair, previous_pairs):
+        if not pairs.connect(AZ.index(crib[j][0]), AZ.index(letters_to_test[i])):
             return False
-        else:
-            previous_pairs.extend(pair)
     return True
 
 
 def compile_switches(letters, loop_indexes, rotors, reflector, start, ring_setting, crib):
-    switches = []
+    switches = Plugboard()
+    no_switches = Plugboard()
+    schedule = RotorSchedule(rotors, start)
     for i, j in enumerate(loop_indexes):
-        left, centre, right = set_rotors(start, rotors)
-        for step in range(j + 1):
-            left, centre, right = step_rotors(left, centre, right, rotors)       
-        enc_letter = rotors_encoding(letters[i], ring_setting, reflector, left, centre, right, '')
-        switch = [''.join((crib[j][0], letters[i])), ''.join((enc_letter, crib[j][1]))]
-        if check_switch_pairs(switch, switches):
-            switches.extend(switch)
-        else:
+        left, centre, right = set_rotors(schedule[j], rotors)                                     # Jump straight to the rotor positions of crib index j
+        enc_letter = rotors_encoding(letters[i], ring_setting, reflector, left, centre, right, no_switches)
+        if not (switches.connect(AZ.index(crib[j][0]), AZ.index(letters[i])) and switches.connect(AZ.index(enc_letter), AZ.index(crib[j][1]))):
             return None
     return switches
 
 
-def check_switch_pairs(switch, other_switches):
-    for i in switch:
-        for j in other_switches:
-            if i != j and i != j[::-1]:
-                if i[0] in j or i[1] in j:
-                    return False
-    return True
-
+# functions of the diagonal board
+def menu_graph(crib):                                                                      # Adjacency list of the crib letters, each edge labelled with its crib index
+    graph = {}
+    for j in crib:
+        a, b = AZ.index(crib[j][0]), AZ.index(crib[j][1])
+        graph.setdefault(a, []).append((b, j))
+        graph.setdefault(b, []).append((a, j))
+    return graph
+
+
+def test_register(scramblers, graph, test_letter, partner):                                # Propagate the hypothesis "test_letter is steckered to partner" to a contradiction or a fixed point
+    partners = [None] * len(AZ)
+    queue = [(test_letter, partner)]
+    while queue:
+        a, y = queue.pop()
+        for p, q in ((a, y), (y, a)):                                                      # Diagonal board: if a is steckered to y, then y is steckered to a
+            if partners[p] is None:
+                partners[p] = q
+                for b, j in graph.get(p, []):                                              # The scrambler at crib index j takes the partner of one end of the edge to the partner of the other
+                    queue.append((b, scramblers[j][q]))
+            elif partners[p] != q:
+                return None
+    return partners
+
+
+def diagonal_board(rotors, crib, reflector, start, ring_setting):
+    graph = menu_graph(crib)
+    if not graph:
+        return None
+    schedule = RotorSchedule(rotors, start)
+    scramblers = {j: scrambler(rotors, reflector, schedule[j], ring_setting) for j in crib}
+    test_letter = max(graph, key=lambda x : len(graph[x]))                                 # The most connected letter rejects wrong hypotheses fastest
+    valid_switches = []
+    for partner in range(len(AZ)):                                                         # At most 26 propagation tests per rotor setup
+        partners = test_register(scramblers, graph, test_letter, partner)
+        if partners:
+            valid_switches.append(Plugboard((AZ[a], AZ[b]) for a, b in enumerate(partners) if b is not None))
+    return valid_switches if valid_switches else None
 
-def set_rotors(start, rotor):
-    ring_left = [deque(AZ), deque(INNER_RING[rotor[0]])]
-    offset = -1 * AZ.index(start[0])
-    ring_left[0].rotate(offset)
-    ring_left[1].rotate(offset)
 
-    ring_centre = [deque(AZ), deque(INNER_RING[rotor[1]])]
-    offset = -1 * AZ.index(start[1])
-    ring_centre[0].rotate(offset)
-    ring_centre[1].rotate(offset)
+CORE_INDEX = {}
 
-    ring_right = [deque(AZ), deque(INNER_RING[rotor[2]])]
-    offset = -1 * AZ.index(start[2])
-    ring_right[0].rotate(offset)
-    ring_right[1].rotate(offset)
 
-    return ring_left, ring_centre, ring_right
+def core_tables_path(path=None):                                                          # The rotors and reflectors of the cores are part of the file name, so changing them builds another file
+    root, extension = os.path.splitext(path or CORE_TABLES_PATH)
+    return f"{root}_{''.join(str(r) for r in sorted(BOMBE_ROTORS))}_{'_'.join(REFLECTOR)}{extension}"
 
 
-def step_rotors(ring_left, ring_centre, ring_right, rotor):
-    if ring_centre[0][0] in TURN_NOTCH[rotor[1]]:
-        ring_centre[0].rotate(-1)
-        ring_centre[1].rotate(-1)
-        ring_left[0].rotate(-1)
-        ring_left[1].rotate(-1)
-    if ring_right[0][0] in TURN_NOTCH[rotor[2]]:
-        ring_centre[0].rotate(-1)
-        ring_centre[1].rotate(-1)
-    ring_right[0].rotate(-1)
-    ring_right[1].rotate(-1)
-    return ring_left, ring_centre, ring_right
+def build_core_tables(path):                                                              # Rotor core of every rotor order, reflector and rotor offsets, as a uint8 array [order, reflector, left, centre, right, letter]
+    orders = list(permutations(sorted(BOMBE_ROTORS), 3))
+    temporary = f'{path}.{os.getpid()}.tmp'
+    tables = np.lib.format.open_memmap(temporary, mode='w+', dtype=np.uint8, shape=(len(orders), len(REFLECTOR), 26, 26, 26, 26))
+    for n, rotors in enumerate(orders):
+        for m, reflector_type in enumerate(REFLECTOR):
+            tables[n, m] = core_table(rotors, reflector_type)
+    tables.flush()
+    del tables
+    os.replace(temporary, path)                                                           # Written under another name first, so no process maps a file being built
+    return np.load(path, mmap_mode='r')
 
 
-def Cesar(alphabets, letter, from_offset, to_offset):
-    from_alphabet = copy(alphabets[0])
-    from_alphabet.rotate(AZ.index(from_offset))
+def core_tables(path=None):                                                               # Memory-map the rotor cores, building the file on first use or when the rotors changed
+    path = core_tables_path(path)
+    if CORE_INDEX.get('path') != path:
+        shape = (len(list(permutations(BOMBE_ROTORS, 3))), len(REFLECTOR), 26, 26, 26, 26)
+        tables = np.load(path, mmap_mode='r') if os.path.exists(path) else None
+        if tables is None or tables.shape != shape:
+            del tables
+            tables = build_core_tables(path)
+        CORE_INDEX['path'] = path
+        CORE_INDEX['cores'] = tables
+        CORE_INDEX['orders'] = {rotors: n for n, rotors in enumerate(permutations(sorted(BOMBE_ROTORS), 3))}
+        CORE_INDEX['reflectors'] = {reflector: m for m, reflector in enumerate(REFLECTOR)}
+    return CORE_INDEX['cores']
 
-    to_alphabet = copy(alphabets[1])
-    to_alphabet.rotate(AZ.index(to_offset))
 
-    rot_tab = letter.maketrans(''.join(from_alphabet), ''.join(to_alphabet))
-    return letter.translate(rot_tab)
+def scrambler(rotors, reflector_type, positions, ring_setting):                          # Permutation of the rotors and reflector (no plugboard) at the given positions
+    if CORE_TABLES and reflector_type in REFLECTOR:                                       # The cores of the 104 composite reflectors would take 16 GB for rotors I-VIII
+        l, c, r = ((AZ.index(p) - AZ.index(s)) % 26 for p, s in zip(positions, ring_setting))
+        tables = core_tables()
+        return tables[CORE_INDEX['orders'][tuple(rotors)], CORE_INDEX['reflectors'][reflector_type], l, c, r].tolist()
+    return Machine(rotors, reflector_type, ring_setting).scrambler(positions)
 
 
 def rotors_encoding(switched_letter_forward, ring_setting, reflector_type, ring_left, ring_centre, ring_right, switches):
     alphabet = deque(AZ)
 
-    switched_letter_forward = plugboard(switched_letter_forward, switches)
+    switched_letter_forward = switches.swap(switched_letter_forward)
 
     rotor_right_forward = Cesar([alphabet, ring_right[1]], switched_letter_forward, 'A', ring_setting[2])
     rotor_centre_forward = Cesar([ring_right[0], ring_centre[1]], rotor_right_forward, ring_setting[2], ring_setting[1])
     rotor_left_forward = Cesar([ring_centre[0], ring_left[1]], rotor_centre_forward, ring_setting[1], ring_setting[0])
 
     reflector_in = Cesar([ring_left[0], alphabet], rotor_left_forward, ring_setting[0], 'A')
-    reflector_out = Cesar([deque(REFLECTOR[reflector_type]), ring_left[0]], reflector_in, 'A', ring_setting[0])
+    reflector_out = Cesar([deque(WIRINGS[reflector_type]), ring_left[0]], reflector_in, 'A', ring_setting[0])
 
     rotor_left_backward = Cesar([ring_left[1], ring_centre[0]], reflector_out, ring_setting[0], ring_setting[1])
     rotor_centre_backward = Cesar([ring_centre[1], ring_right[0]], rotor_left_backward, ring_setting[1], ring_setting[2])
     rotor_right_backward = Cesar([ring_right[1], alphabet], rotor_centre_backward, ring_setting[2], 'A')
 
-    rotor_right_backward = plugboard(rotor_right_backward, switches)
+    rotor_right_backward = switches.swap(rotor_right_backward)
 
     return rotor_right_backward    
 
 
-def plugboard(letter, switches):                                                               # If the input letter is in the list of switches, return the paired letter 
-    for i, j in switches:
-        if letter == i:
-            return j
-        elif letter == j:
-            return i
-    return letter
-
-
-# function of menu analysis
-def expand(crib, letter, reference):
-    pairs = [''.join([crib[i][0], crib[i][1]]) for i in range(len(crib))]
-    extensions = []
-    for i in range(len(pairs)):
-        if reference and i == reference:
+# functions of menu analysis
+def menu_cycles(crib, max_length=MAX_LOOP_LENGTH):                                         # Enumerate all the simple cycles of the menu graph in one pass
+    graph = menu_graph(crib)
+    cycles = []
+    for first in sorted(graph):                                                            # Canonical form: the cycle starts from its smallest letter...
+        stack = [(first, [], {first})]
+        while stack:
+            a, path, visited = stack.pop()
+            for b, j in graph[a]:
+                if b == first and path:
+                    if path[0][2] < j:                                                     # ...and runs in the direction where the first crib index is lower than the last one
+                        cycles.append(path + [(a, b, j)])
+                elif b > first and b not in visited and (max_length is None or len(path) + 1 < max_length):
+                    stack.append((b, path + [(a, b, j)], visited | {b}))
+    cycles.sort(key=lambda x : (len(x), [j for _, _, j in x]))
+    return cycles
+
+
+def menu_components(crib):                                                                 # Connected components of the menu, with their number of independent loops (closures)
+    graph = menu_graph(crib)
+    components = []
+    seen = set()
+    for letter in sorted(graph):
+        if letter in seen:
             continue
-        elif letter == pairs[i][0]:
-            extensions.append((pairs[i], i))
-        elif letter == pairs[i][1]:
-            extensions.append((pairs[i][::-1], i))
-    return extensions
-
-
-# function of menu analysis
-def branch(from_pairs, crib):
-    to_pairs = []
-    for i in range(len(from_pairs)):
-        used_pairs = [z[1] for z in from_pairs[i]]
-        if from_pairs[i][0][0][0] != from_pairs[i][len(from_pairs[i]) - 1][0][1]:                  
-            extensions = expand(crib, from_pairs[i][len(from_pairs[i]) - 1][0][1], from_pairs[i][len(from_pairs[i]) - 1][1])
-            for j in extensions:
-                if j[1] not in used_pairs:
-                    item= copy(from_pairs[i])
-                    item.append(j)
-                    to_pairs.append(item)
-        else:
-            to_pairs.append(from_pairs[i])
-    return to_pairs
+        letters = {letter}
+        queue = [letter]
+        while queue:
+            for b, j in graph[queue.pop()]:
+                if b not in letters:
+                    letters.add(b)
+                    queue.append(b)
+        seen |= letters
+        edges = {j for a in letters for _, j in graph[a]}
+        components.append({'Letters': ''.join(AZ[a] for a in sorted(letters)), 'Edges': len(edges), 'Closures': len(edges) - len(letters) + 1})
+    components.sort(key=lambda x : (x['Closures'], x['Edges']), reverse=True)
+    return components
 
 
-# function of menu analysis
-def prune(menu):
-    pruned_menu = copy(menu)
-    global_indexes = []
-    for i in range(len(menu)):
-        if menu[i][0][0][0] != menu[i][len(menu[i]) - 1][0][1]:
-            pruned_menu.remove(menu[i])
-            continue
-        if len(menu[i]) > 4:
-            pruned_menu.remove(menu[i])
-            continue
-        loop_indexes = {j[1] for j in menu[i]}
-        if loop_indexes in global_indexes:
-            pruned_menu.remove(menu[i])
-            continue
-        else:
-            global_indexes.append(loop_indexes)
-        loop_indexes = []
-        ref = ''
-        for j in menu[i]:
-            if j[0] == ref and len(menu[i]) > 2:
-                pruned_menu.remove(menu[i])
-                break
-            if j[1] in loop_indexes:
-                pruned_menu.remove(menu[i])
-                break
-            else:
-                loop_indexes.append(j[1])
-                ref = j[0][::-1]
-    return pruned_menu
-
-
-def menu_analysis(crib, start_letter):
-    first_pairs = expand(crib, start_letter, None)                                           
-    menu = []
-    for i in range(len(first_pairs)):
-        extensions = expand(crib, first_pairs[i][0][1], first_pairs[i][1])
-        for j in extensions:
-            item = copy([first_pairs[i]])
-            item.append(j)
-            menu.append(item)
-    n= 0
-    while len(menu) > n:
-        n = len(menu)
-        menu = branch(menu, crib)
-    return menu
+def menu_quality(crib):                                                                    # Each closure divides the false stops of a rotor setup by about 26
+    components = menu_components(crib)
+    return {'Components': components, 'Quality': sum(c['Closures'] for c in components)}
 
 
 def crib_analysis(word, enc_text):
@@ -469,6 +895,22 @@ def crib_analysis(word, enc_text):
     return valid_cipher_positions
 
 
+def crib_table(enc_text, words):                                                           # Bulk crib_analysis(): valid offsets of every word, without debug output
+    cipher = np.frombuffer(enc_text.encode('ascii'), dtype=np.uint8)
+    matches = {l: cipher == l for l in set(''.join(words).encode('ascii'))}                # One equality mask of the ciphertext per letter used by the words
+    table = {}
+    for word in words:
+        offsets = len(cipher) - len(word) + 1
+        if offsets < 1:
+            table[word] = np.empty(0, dtype=np.int32)
+            continue
+        self_encipherment = np.zeros(offsets, dtype=bool)
+        for i, l in enumerate(word.encode('ascii')):                                       # Slide the masks: offset o is invalid if word[i] == enc_text[o + i] for some i
+            self_encipherment |= matches[l][i:i + offsets]
+        table[word] = np.flatnonzero(~self_encipherment).astype(np.int32)
+    return table
+
+
 def check_crib(word, cipher_fragment):
     for i in range(len(word)):
         if word[i] == cipher_fragment[i]:                                                   # Check if any of the letters in the word encrypts itself in the cipher fragment
@@ -492,7 +934,11 @@ def prep_text(text):
 
 
 if __name__ == '__main__':
-    enc_text = CIPHERTEXT.replace(' ', '')
     known_word = prep_text(TEXT_FRAGMENT)
+    if CIPHERTEXT_FILE:
+        for n, results in Bombe_headless(CIPHERTEXT_FILE, known_word.upper()):
+            print(n, results[0] if results else 'No stops')
+        raise SystemExit
+    enc_text = CIPHERTEXT.replace(' ', '')
     assert(len(known_word) <= len(enc_text))                                                # The ciphertext should not be shorter than the suspected word in plaintext
     Turing_Bombe(known_word.upper(), enc_text.upper())
@@ -12,98 +12,230 @@ During encryption, each letter of plaintext is set as column of such table (x co
 # The plaintext letter is the y coordinate (row index) of that position.
 
 # A variation of the Vigenere cipher is the Beaufort cipher, where encryption and decryption processes are inverted.
+# The Beaufort cipher subtracts the plaintext letter from the key letter, so the same operation decrypts, while the variant Beaufort
+# subtracts the key letter from the plaintext letter, so it encrypts like the Vigenere decryption.
 """
 
 
 import string
 import secrets
-import pandas as pd
+from time import perf_counter
 from collections import deque
+import numpy as np
 
 
 TEXT = 'Type your text here...'
 KEY_LENGTH = 5
+MODE = 'vigenere'              # 'vigenere', 'beaufort' or 'variant' (variant Beaufort) for encrypt() and decrypt()
+MAX_KEY_LENGTH = 20            # Longest key tried by solve()
+CANDIDATES = 5                 # Key lengths solved by solve(), the best ones by index of coincidence and Kasiski spacings
+KASISKI_SIZE = 3               # Length of the repeated sequences whose spacings are measured
+MULTIPLE_IOC = 0.9             # A key length whose divisor reaches this share of its IoC is taken for a repeated key
+BENCHMARK = False
+TABLES = {}                                                                     # Tabula recta and its inverse, built on first use by tabula_recta()
+ENGLISH = np.array([8.167, 1.492, 2.782, 4.253, 12.702, 2.228, 2.015, 6.094, 6.966, 0.153, 0.772, 4.025, 2.406,
+                    6.749, 7.507, 1.929, 0.095, 5.987, 6.327, 9.056, 2.758, 0.978, 2.360, 0.150, 1.974, 0.074]) / 100    # Letter frequencies of English text
+ENGLISH_IOC = (ENGLISH ** 2).sum()                                              # About 0.066, against 1/26 = 0.038 for random letters
 
-# This piece of code is required to rebuild the classic way of encryption and decryption functions. It build a Vigenere table to look up later in the code.
-az = deque(string.ascii_lowercase)                                              # Creating a deque of the alphabet
-tabula= pd.DataFrame(columns=az, index=az)                                      # Building an empty tabula
-for i in string.ascii_lowercase:                                                # Filling tabula row by row
-    tabula[i] = az
-    az.rotate(-1)                                                               # Rotating the deque left by one at each row
+
+# The classic way of encryption and decryption looks up a Vigenere table, built once as integers: row k is the alphabet rotated left by k.
+def tabula_recta():
+    if 'tabula' not in TABLES:
+        shifts = np.arange(26)
+        TABLES['tabula'] = ((shifts[:, None] + shifts[None, :]) % 26).astype(np.uint8)    # tabula[k, l]: letter at row "k" and column "l"
+        TABLES['inverse'] = np.argsort(TABLES['tabula'], axis=1).astype(np.uint8)          # inverse[k, c]: column where row "k" has the letter "c"
+    return TABLES['tabula'], TABLES['inverse']
+
+
+def to_codes(text):                                                             # One integer per character, so that any text goes through numpy
+    return np.frombuffer(text.encode('utf-32-le'), dtype=np.uint32)
+
+
+def from_codes(codes):
+    return codes.astype(np.uint32).tobytes().decode('utf-32-le')
+
+
+def look_up(table, key, text):                                                  # Replace every letter of text by table[key letter, letter], keeping its case
+    codes = to_codes(text).copy()
+    key = to_codes(key.lower()).astype(np.intp) - ord('a')
+    k = key[np.arange(len(codes)) % len(key)]                                   # Rotate through the key letters, one per character
+    for a in (ord('a'), ord('A')):
+        letters = (codes >= a) & (codes < a + 26)
+        codes[letters] = table[k[letters], codes[letters] - a] + a
+    return from_codes(codes)
 
 
 # This function mimics the classic encryption process of Vigenere cipher
 def encrypt_classic(key, text):
-    enc_text = ''
-    key = list(key)                                                             
-    for i, l in enumerate(text):
-        k = key[i % len(key)]                                                   # Rotate through the key letters
-        if l in string.ascii_lowercase:
-            enc_text += tabula.loc[l][k]                                        # The plaintext letter "l" and the key letter "k" as the coordinates of the ciphertext
-        elif l in string.ascii_uppercase:
-            enc_text += tabula.loc[l.lower()][k].upper()
-        else:
-            enc_text += l
-    return enc_text
+    return look_up(tabula_recta()[0], key, text)                                # The plaintext letter "l" and the key letter "k" as the coordinates of the ciphertext
 
 
 # This function mimics the classic decryption process of Vigenere cipher, with a known key
 def decrypt_classic(key, enc_text):
-    text = ''
-    key = list(key.lower())
-    for i, l in enumerate(enc_text):
+    return look_up(tabula_recta()[1], key, enc_text)                            # The row of the key "k" has the cipher "l" in the column of the plaintext letter
+
+
+# Instead of proceeding through the Vigenere table, these functions do arithmetic mod 26 on the ascii values of all the letters at once
+MODES = {'vigenere': ((1, 1), (1, -1)),                                         # Signs of the letter and of the key letter, to encrypt then to decrypt
+         'beaufort': ((-1, 1), (-1, 1)),                                        # Beaufort: cipher = key - letter, the same operation decrypts
+         'variant': ((1, -1), (1, 1))}                                          # Variant Beaufort: cipher = letter - key, the Vigenere decryption
+
+
+def shift_letters(data, key, letter_sign, key_sign):                            # Shift every ascii letter of a bytes-like buffer by its key letter, keeping its case and skipping other bytes
+    codes = np.frombuffer(data, dtype=np.uint8)
+    folded = codes | 0x20                                                       # Lower case of the letters, no other byte lands on a-z
+    letters = (folded >= ord('a')) & (folded <= ord('z'))
+    key = np.frombuffer(key.lower().encode('ascii'), dtype=np.uint8).astype(np.int16) - ord('a')
+    k = key[(np.cumsum(letters)[letters] - 1) % len(key)]                       # The key moves on only at letters, like the counter k did
+    shifted = (letter_sign * (folded[letters].astype(np.int16) - ord('a')) + key_sign * k) % 26
+    out = codes.copy()
+    out[letters] = shifted + ord('A') + (codes[letters] & 0x20)
+    return out.tobytes()
+
+
+def apply_mode(key, text, signs):                                               # str in, str out; bytes, bytearray or memoryview in, bytes out
+    if isinstance(text, str):
+        return shift_letters(text.encode('utf-8'), key, *signs).decode('utf-8')    # Bytes of other characters are all above ascii, they pass unchanged
+    return shift_letters(text, key, *signs)
+
+
+def encrypt(key, text, mode=MODE):
+    return apply_mode(key, text, MODES[mode][0])
+
+
+def decrypt(key, enc_text, mode=MODE):
+    return apply_mode(key, enc_text, MODES[mode][1])
+
+
+# Cryptanalysis: the key length from the index of coincidence of the cosets (Friedman) and the spacings of repeated sequences (Kasiski),
+# then each key letter by chi-squared of its coset against the English letter frequencies
+def letter_stream(text):                                                        # Letters of text as integers 0-25, the only characters that move the key on
+    data = text.encode('utf-8') if isinstance(text, str) else text
+    folded = np.frombuffer(data, dtype=np.uint8) | 0x20
+    return (folded[(folded >= ord('a')) & (folded <= ord('z'))] - ord('a')).astype(np.intp)
+
+
+def kasiski(letters, max_length=MAX_KEY_LENGTH, size=KASISKI_SIZE):           # For each key length, share of the repeat spacings it divides beyond the share of chance
+    periods = np.arange(1, max_length + 1)
+    if len(letters) <= size:
+        return np.zeros(max_length)
+    codes = sum(letters[i:len(letters) - size + 1 + i] * 26 ** (size - 1 - i) for i in range(size))
+    order = np.argsort(codes, kind='stable')                                    # Equal sequences end up side by side, in order of position
+    spacings = np.diff(order)[codes[order][1:] == codes[order][:-1]]
+    if len(spacings) == 0:
+        return np.zeros(max_length)
+    divided = (spacings[:, None] % periods == 0).mean(axis=0)
+    return np.where(periods > 1, (divided - 1 / periods) / (1 - 1 / periods + 1e-12), 0)     # Any spacing is a multiple of 1, and 1/p of random spacings of p
+
+
+def coset_histograms(letters, period):                                          # Letter counts of every coset (letters encrypted with the same key letter): [coset, letter]
+    return np.bincount(np.arange(len(letters)) % period * 26 + letters, minlength=period * 26).reshape(period, 26)
+
+
+def period_ioc(letters, max_length=MAX_KEY_LENGTH):                             # Mean index of coincidence of the cosets, for each key length
+    iocs = np.zeros(max_length)
+    for period in range(1, max_length + 1):
+        histograms = coset_histograms(letters, period)
+        sizes = histograms.sum(axis=1)
+        iocs[period - 1] = ((histograms * (histograms - 1)).sum(axis=1) / np.maximum(sizes * (sizes - 1), 1)).mean()
+    return iocs
+
+
+def key_lengths(letters, max_length=MAX_KEY_LENGTH, candidates=CANDIDATES):     # Best key lengths: the right one and its multiples have an English IoC, its divisors a high Kasiski share
+    max_length = max(1, min(max_length, len(letters) // 2))
+    iocs = period_ioc(letters, max_length)
+    shares = kasiski(letters, max_length)
+    scores = iocs / ENGLISH_IOC + shares
+    for period in range(max_length, 0, -1):                                     # A multiple fits the cosets at least as well with more key letters: rank it after a divisor with nearly its IoC
+        for divisor in range(1, period):
+            if period % divisor == 0 and iocs[divisor - 1] >= MULTIPLE_IOC * iocs[period - 1]:
+                scores[period - 1] = min(scores[period - 1], scores[divisor - 1] - 1e-6 * period)
+                break
+    return [(int(i) + 1, iocs[i], shares[i]) for i in np.argsort(-scores, kind='stable')[:candidates]]
+
+
+def coset_keys(histograms, mode=MODE):                                          # Key letter of each coset with the lowest chi-squared against English, and that chi-squared
+    a, b = MODES[mode][1]
+    plain = (a * np.arange(26)[None, :] + b * np.arange(26)[:, None]) % 26      # [key letter, cipher letter]: plaintext letter after decryption
+    expected = histograms.sum(axis=1)[:, None, None] * ENGLISH[plain][None, :, :]
+    chi2 = ((histograms[:, None, :] - expected) ** 2 / np.maximum(expected, 1e-12)).sum(axis=2)    # [coset, key letter]
+    keys = chi2.argmin(axis=1)
+    return keys, chi2[np.arange(len(keys)), keys]
+
+
+def shortest_key(key):                                                          # A key repeated a whole number of times encrypts like the key itself
+    for n in range(1, len(key)):
+        if len(key) % n == 0 and key == key[:n] * (len(key) // n):
+            return key[:n]
+    return key
+
+
+def solve(enc_text, mode=MODE, max_length=MAX_KEY_LENGTH, candidates=CANDIDATES):    # (key, plaintext) candidates in the order of their key lengths, best first
+    letters = letter_stream(enc_text)
+    if len(letters) < 2:
+        return []
+    results = {}
+    for period, ioc, share in key_lengths(letters, max_length, candidates):
+        keys, chi2 = coset_keys(coset_histograms(letters, period), mode)
+        key = shortest_key(''.join(string.ascii_lowercase[k] for k in keys))
+        if key in results:
+            continue
+        text = decrypt(key, enc_text, mode)
+        histogram = np.bincount(letter_stream(text), minlength=26)
+        expected = len(letters) * ENGLISH
+        results[key] = {'Key': key, 'Key length': period, 'IoC': float(ioc), 'Kasiski': float(share),
+                        'Chi-squared': float(((histogram - expected) ** 2 / expected).sum() / len(letters)), 'Text': text}
+    return list(results.values())                                               # The chi-squared of longer keys is lower on short texts as they overfit, so it does not rank
+
+
+def benchmark(size=1 << 20, sample=2000):                                      # Table engine on 1 MB of text, against the former per-character DataFrame lookups timed on a sample
+    import pandas as pd
+    text = ''.join(secrets.choice(string.ascii_letters + ' .,') for i in range(size))
+    key = ''.join([secrets.choice(string.ascii_lowercase) for i in range(KEY_LENGTH)])
+    begin = perf_counter()
+    enc_text = encrypt_classic(key, text)
+    encryption = perf_counter() - begin
+    begin = perf_counter()
+    assert(decrypt_classic(key, enc_text) == text)
+    decryption = perf_counter() - begin
+
+    az = deque(string.ascii_lowercase)
+    tabula = pd.DataFrame(columns=az, index=az)
+    for i in string.ascii_lowercase:
+        tabula[i] = az
+        az.rotate(-1)
+    begin = perf_counter()
+    for i, l in enumerate(text[:sample]):
+        k = key[i % len(key)]
+        if l.lower() in tabula.index:
+            assert(tabula.loc[l.lower()][k] == enc_text[i].lower())
+    frame_encryption = (perf_counter() - begin) * size / sample
+    begin = perf_counter()
+    for i, l in enumerate(enc_text[:sample // 10]):
         k = key[i % len(key)]
-        if l in string.ascii_lowercase:
-            c = tabula[k].where(tabula[k] == l).dropna()                                # Decrypting by searching at which row index the column of the key "k" has the value of the cipher "l"
-            text += c.index[0]
-        elif l in string.ascii_uppercase:
-            c = tabula[k].where(tabula[k] == l.lower()).dropna()                        # Decrypting by searching at which row index the column of the key "k" has the value of the cipher "l"
-            text += c.index[0].upper()
-        else:
-            text += l
-    return text
-
-
-# Instead of proceeding through the Vigenere table, this function does arithmetic from ascii values mod 26
-def encrypt(key, text):
-    enc_text = ''
-    k = 0
-    for i, l in enumerate(text):
-        if l in string.ascii_lowercase:
-            enc_text += chr(((ord(l) + ord(key[k % len(key)].lower()) - 2 * ord('a')) % 26) + ord('a'))
-            k += 1
-        elif l in string.ascii_uppercase:
-            enc_text += chr(((ord(l.lower()) + ord(key[k % len(key)].lower()) - 2 * ord('a')) % 26) + ord('a')).upper()
-            k += 1
-        else:
-            enc_text += l
-    return enc_text
-
-
-def decrypt(key, enc_text):
-    text = ''
-    k = 0
-    for i, l in enumerate(enc_text):
-        if l in string.ascii_lowercase:
-            text += chr(((ord(l) - ord(key[k % len(key)].lower())) % 26) + ord('a'))
-            k += 1
-        elif l in string.ascii_uppercase:
-            text += chr(((ord(l.lower()) - ord(key[k % len(key)].lower())) % 26) + ord('a')).upper()
-            k += 1
-        else:
-            text += l
-    return text
+        if l.lower() in tabula.index:
+            assert(tabula[k].where(tabula[k] == l.lower()).dropna().index[0] == text[i].lower())
+    frame_decryption = (perf_counter() - begin) * size / (sample // 10)
+    print(f'Encryption of {size:,} characters: {encryption:.3f}s with the table, about {frame_encryption:.0f}s with the DataFrame ({frame_encryption / encryption:,.0f}x)')
+    print(f'Decryption of {size:,} characters: {decryption:.3f}s with the table, about {frame_decryption:.0f}s with the DataFrame ({frame_decryption / decryption:,.0f}x)')
+    data = text.encode('ascii')
+    for mode in MODES:
+        begin = perf_counter()
+        assert(decrypt(key, encrypt(key, data, mode), mode) == data)
+        print(f'Encryption and decryption of {size:,} bytes in {mode} mode: {perf_counter() - begin:.3f}s')
 
 
 if __name__ == '__main__':
+    if BENCHMARK:
+        benchmark()
     key = ''.join([secrets.choice(string.ascii_lowercase) for i in range(KEY_LENGTH)])                # This Vigenre variation using a random key is also called "running key cipher"
     print(f'Random key: {key}')
-    #print(f'Vigenere table:\n{tabula}')
+    #print(f'Vigenere table:\n{tabula_recta()[0]}')
     
     # Encryption
     enc_text = encrypt_classic(key, TEXT)                               
     print(f'\nCiphertext: {enc_text}')
-    enc_text = encrypt(key, text)
+    enc_text = encrypt(key, TEXT)
     print(f'Ciphertext: {enc_text}')
 
     # Decryption
@@ -112,3 +244,6 @@ if __name__ == '__main__':
     text = decrypt(key, enc_text)
     print(f'Plaintext: {text}')
 
+    # Cryptanalysis, without the key
+    for result in solve(enc_text)[:1]:
+        print(f"\nRecovered key: {result['Key']}\nPlaintext: {result['Text']}")